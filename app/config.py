@@ -24,10 +24,35 @@ DATA_FILE = os.getenv("DATA_FILE", "/opt/vkpanel/data.json")
 SSH_TIMEOUT = int(os.getenv("SSH_TIMEOUT", "10"))
 SSH_COMMAND_TIMEOUT = int(os.getenv("SSH_COMMAND_TIMEOUT", "30"))
 
+# Максимальный размер stdout одной SSH команды (байт), остальное отбрасывается
+SSH_MAX_OUTPUT = int(os.getenv("SSH_MAX_OUTPUT", str(16 * 1024 * 1024)))
+
+# Сколько секунд простаивающее подключение живёт в пуле (как ControlPersist)
+SSH_POOL_IDLE_TTL = int(os.getenv("SSH_POOL_IDLE_TTL", "600"))
+
+# Сколько секунд считать живой статус скрипта свежим (повторные запросы без SSH)
+STATUS_CACHE_TTL = float(os.getenv("STATUS_CACHE_TTL", "3"))
+
+# known_hosts с ключами серверов. Задан — неизвестные хосты отклоняются;
+# пустой — ключ хоста запоминается при первом подключении (в памяти процесса)
+SSH_KNOWN_HOSTS = os.getenv("SSH_KNOWN_HOSTS", "")
+
+# Команды через системный ssh с ControlMaster (только для серверов с ключом)
+SSH_MUX = os.getenv("VKPANEL_SSH_MUX", "0") == "1"
+SSH_MUX_DIR = os.path.expanduser(os.getenv("SSH_MUX_DIR", "~/.ssh/vkpanel-mux"))
+
 # ─── Параллельность ───────────────────────────────────────────
 
-MAX_SSH_WORKERS = int(os.getenv("MAX_SSH_WORKERS", "10"))
-MAX_CLOUD_WORKERS = int(os.getenv("MAX_CLOUD_WORKERS", "5"))
+# Потоков на подключение к хостам при пакетном опросе. Каждый поток
+# подключается к своему хосту, так что MaxStartups одного sshd не задевается
+MAX_SSH_WORKERS = int(os.getenv("MAX_SSH_WORKERS", "32"))
+
+# Максимум одновременных SSH операций при обновлении статусов/cloud
+SSH_CONCURRENCY = int(os.getenv("SSH_CONCURRENCY", "64"))
+
+# Сколько скриптов обновлять задачей на сервер; больше — одним пакетным
+# опросом (bulk_get_script_status: все каналы в одном цикле select)
+BULK_STATUS_THRESHOLD = int(os.getenv("BULK_STATUS_THRESHOLD", "128"))
 
 # ─── Бот продаж ───────────────────────────────────────────────
 
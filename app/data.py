@@ -1,39 +1,79 @@
 """
 Работа с данными (JSON-файл).
-Файловая блокировка для безопасной параллельной записи.
+Запись атомарная: временный файл + os.replace.
 """
-import fcntl
-import json
 import logging
 import os
+import tempfile
+from collections import defaultdict
 from datetime import datetime
-from typing import Any
+from typing import Any, Optional
+
+import orjson
 
 from .config import DATA_FILE
+from .utils import ip_sort_key
 
 logger = logging.getLogger(__name__)
 
+# Содержимое data.json в памяти: ((st_ino, st_mtime_ns, st_size), bytes).
+# Файл читается с диска только если его изменили снаружи (правка руками,
+# восстановление из бэкапа). Каждый вызов получает свою копию данных —
+# изменения, не дошедшие до save_data, не видны другим запросам.
+_snapshot: Optional[tuple[tuple[int, int, int], bytes]] = None
+
+
+def _file_key() -> Optional[tuple[int, int, int]]:
+    """
+    Версия файла данных; None если файла нет.
+
+    save_data заменяет файл целиком (новый inode), так что st_ino
+    отличает нашу запись от чужой того же размера в тот же тик mtime.
+    """
+    try:
+        st = os.stat(DATA_FILE)
+    except OSError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
 
 def load_data() -> dict:
-    """Загрузить данные из JSON файла."""
-    if os.path.exists(DATA_FILE):
+    """
+    Загрузить данные из JSON файла.
+
+    Пока файл не изменился на диске, разбирается содержимое из памяти,
+    без чтения файла. Возвращается новый dict — его можно менять.
+    """
+    global _snapshot
+    key = _file_key()
+    if key is not None:
         try:
-            with open(DATA_FILE, "r") as f:
-                data = json.load(f)
-                # Обязательные ключи
-                data.setdefault("servers", [])
-                data.setdefault("accounts", [])
-                data.setdefault("projects", [])
-                data.setdefault("status_cache", {})
-                data.setdefault("cloud_cache", {})
-                data.setdefault("projects_cache", {})
-                data.setdefault("last_update", None)
-                data.setdefault("cloud_last_update", None)
-                data.setdefault("projects_last_update", None)
-                data.setdefault("sales", {})
-                data.setdefault("rentals", {})
-                return data
-        except json.JSONDecodeError as e:
+            if _snapshot is not None and _snapshot[0] == key:
+                raw = _snapshot[1]
+            else:
+                with open(DATA_FILE, "rb") as f:
+                    raw = f.read()
+                _snapshot = (key, raw)
+            data = orjson.loads(raw)
+            # Обязательные ключи
+            data.setdefault("servers", [])
+            data.setdefault("accounts", [])
+            data.setdefault("projects", [])
+            data.setdefault("status_cache", {})
+            data.setdefault("cloud_cache", {})
+            data.setdefault("cloud_stats", {})
+            data.setdefault("projects_cache", {})
+            data.setdefault("last_update", None)
+            data.setdefault("cloud_last_update", None)
+            data.setdefault("projects_last_update", None)
+            data.setdefault("sales", {})
+            data.setdefault("rentals", {})
+            # Раньше здесь хранилась готовая группировка проектов — вторая
+            # копия всех IP; при следующем save_data ключи исчезнут из файла
+            data.pop("projects_grouped", None)
+            data.pop("projects_stats", None)
+            return data
+        except orjson.JSONDecodeError as e:
             logger.error(f"Failed to parse {DATA_FILE}: {e}")
         except Exception as e:
             logger.error(f"Failed to load {DATA_FILE}: {e}")
@@ -44,6 +84,7 @@ def load_data() -> dict:
         "projects": [],
         "status_cache": {},
         "cloud_cache": {},
+        "cloud_stats": {},
         "projects_cache": {},
         "last_update": None,
         "cloud_last_update": None,
@@ -54,20 +95,43 @@ def load_data() -> dict:
 
 
 def save_data(data: dict) -> bool:
-    """Сохранить данные в JSON файл с файловой блокировкой (fcntl.flock)."""
+    """
+    Сохранить данные в JSON файл.
+
+    Пишем во временный файл рядом и атомарно подменяем им data.json:
+    читатель видит либо старый файл, либо новый целиком.
+    """
+    global _snapshot
+    tmp_path = None
     try:
-        os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
-        with open(DATA_FILE, "w") as f:
-            # Эксклюзивная блокировка для предотвращения race condition
-            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
-            try:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-            finally:
-                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        data_dir = os.path.dirname(DATA_FILE)
+        os.makedirs(data_dir, exist_ok=True)
+        raw = orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+        fd, tmp_path = tempfile.mkstemp(dir=data_dir, prefix=".data-", suffix=".tmp")
+        try:
+            mode = os.stat(DATA_FILE).st_mode & 0o777
+        except OSError:
+            mode = 0o644
+        os.chmod(tmp_path, mode)  # mkstemp создаёт файл с правами 0600
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, DATA_FILE)
+        tmp_path = None
+        # Записанное и есть актуальный снимок — перечитывать не нужно
+        _snapshot = (_file_key(), raw)
         return True
     except Exception as e:
+        _snapshot = None
         logger.error(f"Failed to save {DATA_FILE}: {e}")
         return False
+    finally:
+        if tmp_path is not None:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
 
 
 def get_server_by_id(data: dict, server_id: int) -> dict | None:
@@ -95,6 +159,59 @@ def get_cached_status(data: dict, server_id: int, script_id: int) -> dict:
     return data.get("status_cache", {}).get(cache_key, {})
 
 
+def count_ips(ips: list[dict]) -> dict:
+    """Счётчики IP проекта: total / attached / free."""
+    attached = sum(1 for ip in ips if ip.get("attached"))
+    return {"total": len(ips), "attached": attached, "free": len(ips) - attached}
+
+
+def project_ip_counts(cached: dict) -> dict:
+    """Счётчики IP из записи projects_cache (у старых записей их нет — считаем)."""
+    if "total" in cached:
+        return {"total": cached["total"], "attached": cached["attached"], "free": cached["free"]}
+    return count_ips(cached.get("ips", []))
+
+
+def sort_project_ips(ips: list[dict]) -> list[dict]:
+    """IP проекта в числовом порядке — так они и хранятся в projects_cache."""
+    return sorted(ips, key=lambda x: ip_sort_key(x.get("ip")))
+
+
+def build_projects_grouped(projects: list[dict], projects_cache: dict) -> tuple[list[dict], dict]:
+    """
+    Сгруппировать проекты по аккаунту и посчитать статистику IP.
+
+    Возвращает (accounts, stats): аккаунты отсортированы по количеству IP
+    (больше — выше), stats = {total, attached, free}. Списки IP берутся
+    из projects_cache как есть (уже отсортированы при записи), счётчики —
+    из сохранённых total/attached/free, так что по самим IP проход не нужен.
+    """
+    accounts_dict = defaultdict(lambda: {"projects": [], "total_ips": 0})
+    stats = {"total": 0, "attached": 0, "free": 0}
+
+    for proj in projects:
+        cached = projects_cache.get(proj["name"], {})
+
+        acc = accounts_dict[proj["username"]]
+        acc["projects"].append({
+            "name": proj["name"],
+            "os_project_name": cached.get("os_project_name"),
+            "ips": cached.get("ips", []),
+            "error": cached.get("error"),
+        })
+
+        counts = project_ip_counts(cached)
+        acc["total_ips"] += counts["total"]
+        for key in stats:
+            stats[key] += counts[key]
+
+    accounts = sorted(
+        ({"username": username, **acc} for username, acc in accounts_dict.items()),
+        key=lambda x: -x["total_ips"],
+    )
+    return accounts, stats
+
+
 def get_cached_cloud(data: dict, server_id: int, script_id: int) -> dict:
     """Получить кэшированные cloud данные."""
     cache_key = f"{server_id}-{script_id}"
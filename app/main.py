@@ -2,6 +2,9 @@
 VK IP Panel — главный модуль приложения.
 FastAPI + Jinja2 + Paramiko для SSH.
 """
+import asyncio
+import hashlib
+import hmac
 import logging
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
@@ -15,25 +18,29 @@ def now_msk() -> datetime:
     return datetime.now(MSK)
 from typing import Optional
 
+import orjson
 from fastapi import FastAPI, Request, HTTPException, Form, UploadFile, File
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
 
 from .config import (
     ADMIN_USER, ADMIN_PASS, SECRET_KEY,
-    BASE_DIR, MAX_SSH_WORKERS, MAX_CLOUD_WORKERS,
+    BASE_DIR, MAX_SSH_WORKERS, SSH_CONCURRENCY, BULK_STATUS_THRESHOLD,
     BOT_API_KEY,
 )
 from .data import (
     load_data, save_data,
     get_server_by_id, get_script_by_id,
     update_status_cache, get_cached_status, get_cached_cloud,
+    build_projects_grouped, sort_project_ips,
+    count_ips, project_ip_counts,
 )
-from .ssh import get_script_status, control_script, get_floating_ips_via_cli, change_script_project, update_script_subnets, ssh_connect, ssh_exec
-from .openstack import get_project_floating_ips
+from .ssh import get_script_status, get_host_script_statuses, bulk_get_script_status, control_script, control_scripts_bulk, get_floating_ips_via_cli, change_script_project, update_script_subnets, pooled_ssh, ssh_exec, quoted_service_name
+from .openstack import get_project_floating_ips, init_http_client, close_http_client
 from .subnets import ALL_SUBNETS
+from .utils import ip_sort_key
 from .monitoring import (
     save_ssh_key, get_ssh_key_path, get_ssh_user,
     check_ssh_reachable, check_agent_version, deploy_agent, trigger_agent,
@@ -51,9 +58,35 @@ logger = logging.getLogger(__name__)
 # ─── FastAPI приложение ───────────────────────────────────────
 
 
+async def fetch_projects_cache(projects: list[dict]) -> dict:
+    """
+    Получить floating IP всех проектов параллельно.
+
+    Возвращает projects_cache: name -> {ips, error, os_project_name,
+    total, attached, free}.
+    Сбой одного проекта не прерывает остальные.
+    """
+    results = await asyncio.gather(
+        *(get_project_floating_ips(p) for p in projects),
+        return_exceptions=True,
+    )
+
+    projects_cache = {}
+    for proj, r in zip(projects, results):
+        if isinstance(r, BaseException):
+            logger.error(f"Project refresh failed for {proj['name']}: {r!r}")
+            r = {"name": proj["name"], "ips": [], "error": str(r)[:100], "os_project_name": None}
+        projects_cache[r["name"]] = {
+            "ips": sort_project_ips(r["ips"]),
+            "error": r["error"],
+            "os_project_name": r.get("os_project_name"),
+            **count_ips(r["ips"]),
+        }
+    return projects_cache
+
+
 async def _auto_refresh_projects():
     """Фоновая задача: обновление projects_cache каждый день в 07:00 MSK."""
-    import asyncio
     while True:
         now = now_msk()
         # Следующее 07:00
@@ -69,18 +102,8 @@ async def _auto_refresh_projects():
             data = load_data()
             projects = data.get("projects", [])
             if projects:
-                with ThreadPoolExecutor(max_workers=MAX_CLOUD_WORKERS) as executor:
-                    results = list(executor.map(get_project_floating_ips, projects))
-
-                projects_cache = {}
-                total = 0
-                for r in results:
-                    projects_cache[r["name"]] = {
-                        "ips": r["ips"],
-                        "error": r["error"],
-                        "os_project_name": r.get("os_project_name"),
-                    }
-                    total += len(r["ips"])
+                projects_cache = await fetch_projects_cache(projects)
+                total = sum(c["total"] for c in projects_cache.values())
 
                 data["projects_cache"] = projects_cache
                 data["projects_last_update"] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -95,11 +118,16 @@ async def _auto_refresh_projects():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup/shutdown events."""
-    import asyncio
     logger.info("VK IP Panel starting...")
+    # Пул потоков для asyncio.to_thread — не меньше лимита SSH операций
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=SSH_CONCURRENCY, thread_name_prefix="ssh")
+    )
+    init_http_client()
     task = asyncio.create_task(_auto_refresh_projects())
     yield
     task.cancel()
+    await close_http_client()
     logger.info("VK IP Panel stopping...")
 
 
@@ -133,7 +161,12 @@ async def login_page(request: Request, error: str = None):
 
 @app.post("/login")
 async def login(request: Request, username: str = Form(...), password: str = Form(...)):
-    if username == ADMIN_USER and password == ADMIN_PASS:
+    # Сравнение за постоянное время; & — чтобы всегда проверялись оба поля
+    ok = (
+        hmac.compare_digest(username.encode(), ADMIN_USER.encode())
+        & hmac.compare_digest(password.encode(), ADMIN_PASS.encode())
+    )
+    if ok:
         request.session["user"] = username
         logger.info(f"User logged in: {username}")
         return RedirectResponse("/", status_code=303)
@@ -221,16 +254,12 @@ async def servers_page(request: Request):
     
     projects_with_stats = []
     for proj in projects:
-        cached = projects_cache.get(proj["name"], {})
-        ips = cached.get("ips", [])
-        total = len(ips)
-        attached = sum(1 for ip in ips if ip.get("attached"))
-        
+        counts = project_ip_counts(projects_cache.get(proj["name"], {}))
         projects_with_stats.append({
             **proj,
-            "total_ips": total,
-            "attached_ips": attached,
-            "free_ips": total - attached,
+            "total_ips": counts["total"],
+            "attached_ips": counts["attached"],
+            "free_ips": counts["free"],
         })
     
     return templates.TemplateResponse("servers.html", {
@@ -420,11 +449,11 @@ async def script_action(request: Request, server_id: int, script_id: int, action
         return RedirectResponse("/", status_code=303)
 
     # Выполняем действие
-    success, msg = control_script(server, script, action)
+    success, msg = await run_ssh(control_script, server, script, action)
 
     # Обновляем кэш статуса после действия
     if success:
-        new_status = get_script_status(server, script)
+        new_status = await run_ssh(get_script_status, server, script)
         update_status_cache(data, server_id, script_id, {
             "server_id": server_id,
             "script_id": script_id,
@@ -454,6 +483,35 @@ async def script_action(request: Request, server_id: int, script_id: int, action
     return RedirectResponse(referer, status_code=303)
 
 
+@app.post("/api/servers/{server_id}/scripts/{action}")
+async def api_script_action_all(request: Request, server_id: int, action: str):
+    """start/stop/restart всех скриптов сервера одним SSH вызовом."""
+    if not get_current_user(request):
+        raise HTTPException(status_code=401)
+
+    if action not in ("start", "stop", "restart"):
+        return JSONResponse({"ok": False, "error": "Invalid action"}, status_code=400)
+
+    data = load_data()
+    server = get_server_by_id(data, server_id)
+    if not server:
+        return JSONResponse({"ok": False, "error": "Server not found"}, status_code=404)
+
+    scripts = server.get("scripts", [])
+    outcomes = await run_ssh(control_scripts_bulk, server, scripts, action)
+
+    # Статусы сняты той же командой, что и systemctl — повторного SSH нет
+    for script, (_, _, status) in zip(scripts, outcomes):
+        update_status_cache(data, server_id, script["id"], _status_entry(server, script, status))
+    save_data(data)
+
+    results = [
+        {"script_id": script["id"], "ok": success, "message": msg, "running": status["running"]}
+        for script, (success, msg, status) in zip(scripts, outcomes)
+    ]
+    return {"ok": all(r["ok"] for r in results), "action": action, "results": results}
+
+
 @app.post("/api/scripts/{server_id}/{script_id}/change-project")
 async def api_change_project(request: Request, server_id: int, script_id: int, project_name: str = Form(...)):
     """Сменить проект для скрипта."""
@@ -484,11 +542,11 @@ async def api_change_project(request: Request, server_id: int, script_id: int, p
         project = {**project, "os_project_name": os_pname}
 
     # Меняем проект
-    success, msg = change_script_project(server, script, project)
+    success, msg = await run_ssh(change_script_project, server, script, project)
 
     if success:
         # Обновляем кэш
-        new_status = get_script_status(server, script)
+        new_status = await run_ssh(get_script_status, server, script)
         update_status_cache(data, server_id, script_id, {
             "server_id": server_id,
             "script_id": script_id,
@@ -550,12 +608,63 @@ async def api_update_subnets(request: Request, server_id: int, script_id: int):
     import json
     subnets_json_str = json.dumps(selected, ensure_ascii=False)
 
-    success, msg = update_script_subnets(server, script, subnets_json_str)
+    success, msg = await run_ssh(update_script_subnets, server, script, subnets_json_str)
     return JSONResponse({"ok": success, "message": msg})
 
 
 # ─── API ──────────────────────────────────────────────────────
 
+# Ограничение одновременных SSH операций: сотни параллельных подключений
+# дают kex-таймауты и срабатывание защиты sshd/файрвола на серверах
+SSH_SEM = asyncio.Semaphore(SSH_CONCURRENCY)
+
+
+async def run_ssh(func, *args):
+    """Выполнить блокирующую SSH функцию в потоке, не более SSH_CONCURRENCY одновременно."""
+    async with SSH_SEM:
+        return await asyncio.to_thread(func, *args)
+
+
+def _journal_tail(server: dict, script: dict, lines: int) -> tuple[int, str, str]:
+    """Последние строки journalctl сервиса скрипта (блокирующий SSH вызов)."""
+    cmd = f"journalctl -u {quoted_service_name(script)} -n {int(lines)} --no-pager 2>&1"
+    with pooled_ssh(server) as client:
+        return ssh_exec(client, cmd)
+
+
+def _status_entry(server: dict, script: dict, status: dict) -> dict:
+    """Статус скрипта в формате status_cache."""
+    return {
+        "server_id": server["id"],
+        "script_id": script["id"],
+        "server_name": server["name"],
+        "script_name": script["name"],
+        "running": status["running"],
+        "substate": status["substate"],
+        "main_pid": status["main_pid"],
+        "cycles": status["cycles"],
+        "success": status["success"],
+        "last_ip": status["last_ip"],
+        "error": status["error"],
+        "account": status["account"],
+        "project": status["project"],
+    }
+
+
+def _fetch_host_statuses(server: dict) -> list[dict]:
+    """Статусы всех скриптов сервера (один SSH вызов на хост)."""
+    scripts = server.get("scripts", [])
+    statuses = get_host_script_statuses(server, scripts)
+    return [_status_entry(server, script, status) for script, status in zip(scripts, statuses)]
+
+
+def _fetch_status_chunk(servers: list[dict]) -> list[dict]:
+    """Статусы скриптов пачки серверов одним пакетным опросом (блокирующий вызов)."""
+    pairs = [(server, script) for server in servers for script in server.get("scripts", [])]
+    statuses = bulk_get_script_status(pairs, max_workers=MAX_SSH_WORKERS)
+    return [_status_entry(server, script, status) for (server, script), status in zip(pairs, statuses)]
+
+
 @app.post("/api/refresh")
 async def api_refresh_status(request: Request):
     """Обновить статусы всех скриптов и сохранить в кэш."""
@@ -564,32 +673,19 @@ async def api_refresh_status(request: Request):
 
     data = load_data()
 
-    # Собираем задачи для параллельного выполнения
-    tasks = []
-    for server in data.get("servers", []):
-        for script in server.get("scripts", []):
-            tasks.append((server, script))
-
-    def fetch_status(args):
-        server, script = args
-        status = get_script_status(server, script)
-        return {
-            "server_id": server["id"],
-            "script_id": script["id"],
-            "server_name": server["name"],
-            "script_name": script["name"],
-            "running": status["running"],
-            "cycles": status["cycles"],
-            "success": status["success"],
-            "last_ip": status["last_ip"],
-            "error": status["error"],
-            "account": status["account"],
-            "project": status["project"],
-        }
+    # Одна задача на сервер: статусы всех его скриптов за один SSH вызов
+    servers = [s for s in data.get("servers", []) if s.get("scripts")]
+    scripts_count = sum(len(s["scripts"]) for s in servers)
 
-    # Выполняем параллельно
-    with ThreadPoolExecutor(max_workers=MAX_SSH_WORKERS) as executor:
-        results = list(executor.map(fetch_status, tasks))
+    if scripts_count > BULK_STATUS_THRESHOLD:
+        # Много скриптов: вместо задачи на сервер — один пакетный опрос
+        # в потоке, каналы всех хостов читаются одним циклом select.
+        # Подключения берутся из общего пула процесса
+        results = await run_ssh(_fetch_status_chunk, servers)
+    else:
+        # Выполняем параллельно
+        parts = await asyncio.gather(*(run_ssh(_fetch_host_statuses, s) for s in servers))
+        results = [r for part in parts for r in part]
 
     # Сохраняем в кэш
     status_cache = {}
@@ -635,11 +731,13 @@ async def api_script_status(request: Request, server_id: int, script_id: int):
     if not script:
         raise HTTPException(status_code=404)
 
-    status = get_script_status(server, script)
+    status = await run_ssh(get_script_status, server, script)
     return {
         "server_id": server_id,
         "script_id": script_id,
         "running": status["running"],
+        "substate": status["substate"],
+        "main_pid": status["main_pid"],
         "cycles": status["cycles"],
         "success": status["success"],
         "last_ip": status["last_ip"],
@@ -649,6 +747,20 @@ async def api_script_status(request: Request, server_id: int, script_id: int):
 
 # ─── Cloud страницы ───────────────────────────────────────────
 
+def cloud_stats(cloud_cache: dict) -> dict:
+    """Суммарная статистика cloud_cache по счётчикам проектов."""
+    total = 0
+    attached = 0
+    for project_data in cloud_cache.values():
+        ips = project_data.get("ips", [])
+        total += project_data.get("total", len(ips))
+        if "attached" in project_data:
+            attached += project_data["attached"]
+        else:
+            attached += sum(1 for ip in ips if ip.get("attached"))
+    return {"total": total, "attached": attached, "free": total - attached}
+
+
 @app.get("/cloud", response_class=HTMLResponse)
 async def cloud_ips_page(request: Request):
     """Страница с floating IP из VK Cloud."""
@@ -660,21 +772,17 @@ async def cloud_ips_page(request: Request):
     cloud_cache = data.get("cloud_cache", {})
     cloud_last_update = data.get("cloud_last_update")
 
+    # Статистика считается при обновлении кэша
+    stats = data.get("cloud_stats") or cloud_stats(cloud_cache)
+
     # Собираем все IP из кэша
     all_ips = []
-    stats = {"total": 0, "attached": 0, "free": 0}
 
     for key, project_data in cloud_cache.items():
         account = project_data.get("account", "-")
         project = project_data.get("project", "-")
 
         for ip in project_data.get("ips", []):
-            stats["total"] += 1
-            if ip.get("attached"):
-                stats["attached"] += 1
-            else:
-                stats["free"] += 1
-
             all_ips.append({
                 "ip": ip.get("ip"),
                 "account": account,
@@ -686,7 +794,7 @@ async def cloud_ips_page(request: Request):
             })
 
     # Сортируем по аккаунту, потом по IP
-    all_ips.sort(key=lambda x: (x["account"] or "", x["ip"] or ""))
+    all_ips.sort(key=lambda x: (x["account"] or "", ip_sort_key(x["ip"])))
 
     return templates.TemplateResponse("cloud.html", {
         "request": request,
@@ -714,40 +822,36 @@ async def api_cloud_refresh(request: Request):
     def fetch_cloud(args):
         server, script = args
         result = get_floating_ips_via_cli(server, script)
+        result["total"] = len(result["ips"])
+        result["attached"] = sum(1 for ip in result["ips"] if ip.get("attached"))
         return {
             "key": f"{server['id']}-{script['id']}",
             "data": result,
         }
 
     # Параллельно получаем данные
-    with ThreadPoolExecutor(max_workers=MAX_CLOUD_WORKERS) as executor:
-        results = list(executor.map(fetch_cloud, tasks))
+    results = await asyncio.gather(*(run_ssh(fetch_cloud, t) for t in tasks))
 
     # Сохраняем в кэш
     cloud_cache = {}
     for r in results:
         cloud_cache[r["key"]] = r["data"]
 
+    # Статистика — сумма счётчиков по проектам
+    stats = cloud_stats(cloud_cache)
+
     data["cloud_cache"] = cloud_cache
+    data["cloud_stats"] = stats
     data["cloud_last_update"] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
     save_data(data)
 
-    # Считаем статистику
-    total = 0
-    attached = 0
-    for project_data in cloud_cache.values():
-        for ip in project_data.get("ips", []):
-            total += 1
-            if ip.get("attached"):
-                attached += 1
-
-    logger.info(f"Cloud refresh: {total} IPs, {attached} attached")
+    logger.info(f"Cloud refresh: {stats['total']} IPs, {stats['attached']} attached")
 
     return {
         "ok": True,
-        "total_ips": total,
-        "attached": attached,
-        "free": total - attached,
+        "total_ips": stats["total"],
+        "attached": stats["attached"],
+        "free": stats["free"],
         "last_update": data["cloud_last_update"],
     }
 
@@ -767,7 +871,7 @@ async def api_cloud_ips(request: Request, server_id: int, script_id: int):
     if not script:
         raise HTTPException(status_code=404, detail="Script not found")
 
-    result = get_floating_ips_via_cli(server, script)
+    result = await run_ssh(get_floating_ips_via_cli, server, script)
     return result
 
 
@@ -832,9 +936,8 @@ async def projects_page(request: Request):
             })
         servers_scripts_info.append(srv_info)
 
-    # Группируем проекты по аккаунту
-    accounts_dict = {}
-    stats = {"total": 0, "attached": 0, "free": 0}
+    # Скрипты по проектам (зависят от status_cache, поэтому считаются здесь)
+    project_scripts: dict[str, list[dict]] = {}
     scripts_active = 0
     scripts_total = 0
 
@@ -846,37 +949,13 @@ async def projects_page(request: Request):
         # Фоллбэк: если os_project_name ещё не загружен, пробуем по name
         if not scripts_for_proj:
             scripts_for_proj = project_scripts_map.get(proj["name"], [])
+        project_scripts[proj["name"]] = scripts_for_proj
         scripts_total += len(scripts_for_proj)
         scripts_active += sum(1 for s in scripts_for_proj if s["running"])
 
-        proj_data = {
-            "name": proj["name"],
-            "os_project_name": cached.get("os_project_name"),
-            "ips": cached.get("ips", []),
-            "error": cached.get("error"),
-            "scripts": scripts_for_proj,
-        }
-
-        username = proj["username"]
-        if username not in accounts_dict:
-            accounts_dict[username] = {
-                "username": username,
-                "projects": [],
-                "total_ips": 0,
-            }
-
-        accounts_dict[username]["projects"].append(proj_data)
-        accounts_dict[username]["total_ips"] += len(proj_data["ips"])
-
-        for ip in proj_data["ips"]:
-            stats["total"] += 1
-            if ip.get("attached"):
-                stats["attached"] += 1
-            else:
-                stats["free"] += 1
-
-    # Сортируем аккаунты по количеству IP (больше — выше)
-    accounts = sorted(accounts_dict.values(), key=lambda x: -x["total_ips"])
+    # Группировка по аккаунтам: IP уже отсортированы в projects_cache,
+    # счётчики сохранены там же — проход только по проектам
+    accounts, stats = build_projects_grouped(projects, projects_cache)
 
     # Маппинг IP -> арендатор
     ip_tenant_map = {}
@@ -892,6 +971,7 @@ async def projects_page(request: Request):
         "request": request,
         "user": user,
         "accounts": accounts,
+        "project_scripts": project_scripts,
         "total_projects": len(projects),
         "stats": stats,
         "scripts_active": scripts_active,
@@ -919,31 +999,11 @@ async def api_projects_refresh(request: Request):
     if not projects:
         return {"ok": False, "error": "No projects configured"}
 
-    def fetch_project(proj):
-        return get_project_floating_ips(proj)
-
     # Параллельно получаем данные
-    with ThreadPoolExecutor(max_workers=MAX_CLOUD_WORKERS) as executor:
-        results = list(executor.map(fetch_project, projects))
-
-    # Сохраняем в кэш
-    projects_cache = {}
-    stats = {"total": 0, "attached": 0, "free": 0}
-
-    for r in results:
-        projects_cache[r["name"]] = {
-            "ips": r["ips"],
-            "error": r["error"],
-            "os_project_name": r.get("os_project_name"),
-        }
-        for ip in r["ips"]:
-            stats["total"] += 1
-            if ip.get("attached"):
-                stats["attached"] += 1
-            else:
-                stats["free"] += 1
+    projects_cache = await fetch_projects_cache(projects)
 
     data["projects_cache"] = projects_cache
+    _, stats = build_projects_grouped(projects, projects_cache)
     data["projects_last_update"] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
     save_data(data)
 
@@ -1339,11 +1399,17 @@ async def api_tenant_iperf(
 
     try:
         from .monitoring import _ssh_connect_by_key, _ssh_exec
-        client = _ssh_connect_by_key(ip, key_path, ssh_user)
-        # Запускаем iperf3 клиент
-        cmd = f"iperf3 -c {target} -p {port} -t {duration} -J"
-        code, out, err = _ssh_exec(client, cmd, timeout=duration + 15)
-        client.close()
+
+        def run_iperf():
+            client = _ssh_connect_by_key(ip, key_path, ssh_user)
+            try:
+                # Запускаем iperf3 клиент
+                cmd = f"iperf3 -c {target} -p {port} -t {duration} -J"
+                return _ssh_exec(client, cmd, timeout=duration + 15)
+            finally:
+                client.close()
+
+        code, out, err = await run_ssh(run_iperf)
 
         if code != 0:
             error_msg = err.strip() or out.strip() or "iperf3 завершился с ошибкой"
@@ -1435,15 +1501,8 @@ async def api_get_logs(request: Request, server_id: int, script_id: int, lines:
     if not script:
         return JSONResponse({"ok": False, "error": "Скрипт не найден"}, status_code=404)
 
-    service_name = script.get("service_name", f"vk-fip@{script['name']}")
-
     try:
-        client = ssh_connect(
-            server["host"], server.get("port", 22),
-            server["user"], server.get("password"), server.get("key_path"),
-        )
-        code, out, err = ssh_exec(client, f"journalctl -u {service_name} -n {lines} --no-pager 2>&1")
-        client.close()
+        code, out, err = await run_ssh(_journal_tail, server, script, lines)
 
         log_text = out.strip() if code == 0 else (err.strip() or out.strip())
 
@@ -1482,14 +1541,8 @@ async def api_get_all_logs(request: Request, lines: int = Form(10)):
 
     def fetch_log(args):
         server, script = args
-        service_name = script.get("service_name", f"vk-fip@{script['name']}")
         try:
-            client = ssh_connect(
-                server["host"], server.get("port", 22),
-                server["user"], server.get("password"), server.get("key_path"),
-            )
-            code, out, err = ssh_exec(client, f"journalctl -u {service_name} -n {lines} --no-pager 2>&1")
-            client.close()
+            code, out, err = _journal_tail(server, script, lines)
             return {
                 "server_id": server["id"],
                 "script_id": script["id"],
@@ -1508,8 +1561,7 @@ async def api_get_all_logs(request: Request, lines: int = Form(10)):
                 "error": str(e)[:200],
             }
 
-    with ThreadPoolExecutor(max_workers=MAX_SSH_WORKERS) as executor:
-        results = list(executor.map(fetch_log, tasks))
+    results = await asyncio.gather(*(run_ssh(fetch_log, t) for t in tasks))
 
     # Сохраняем в кэш
     now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
@@ -1563,6 +1615,20 @@ def require_bot_api_key(request: Request):
         raise HTTPException(status_code=403, detail="Invalid API key")
 
 
+def etag_json(request: Request, payload: dict) -> Response:
+    """
+    JSON ответ с ETag для бот-эндпоинтов.
+
+    Если If-None-Match совпадает с ETag (каталог не менялся) —
+    304 без тела, бот берёт данные из своего кэша.
+    """
+    body = orjson.dumps(payload)
+    etag = f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    if request.headers.get("If-None-Match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+
 @app.post("/api/sales/{username}/toggle")
 async def api_sales_toggle(
     request: Request,
@@ -1605,7 +1671,7 @@ async def api_bot_accounts(request: Request):
     pricing_sale = pricing.get("sale_per_ip", 30000)
 
     if not sales:
-        return {"accounts": [], "price_per_ip": pricing_sale}
+        return etag_json(request, {"accounts": [], "price_per_ip": pricing_sale})
 
     # Группируем проекты по username
     accounts_projects: dict[str, list] = {}
@@ -1651,7 +1717,7 @@ async def api_bot_accounts(request: Request):
 
     result.sort(key=lambda x: -x["ip_count"])
 
-    return {"accounts": result, "price_per_ip": pricing_sale}
+    return etag_json(request, {"accounts": result, "price_per_ip": pricing_sale})
 
 
 def mask_project_name(name: str) -> str:
@@ -1703,7 +1769,7 @@ async def api_bot_rentals(request: Request):
     pricing_rent = pricing.get("rent_per_ip", 500)
 
     if not rentals:
-        return {"projects": [], "price_per_ip": pricing_rent}
+        return etag_json(request, {"projects": [], "price_per_ip": pricing_rent})
 
     result = []
     for proj in projects:
@@ -1728,7 +1794,7 @@ async def api_bot_rentals(request: Request):
         })
 
     result.sort(key=lambda x: -x["ip_count"])
-    return {"projects": result, "price_per_ip": pricing_rent}
+    return etag_json(request, {"projects": result, "price_per_ip": pricing_rent})
 
 
 # ─── Мониторинг трафика ────────────────────────────────────────
@@ -1936,7 +2002,7 @@ async def api_monitoring_deploy_ip(request: Request, ip: str):
     else:
         panel_url = str(request.base_url).rstrip("/")
 
-    result = deploy_agent(ip, key_path, ssh_user, panel_url)
+    result = await run_ssh(deploy_agent, ip, key_path, ssh_user, panel_url)
 
     if result["ok"]:
         # Сохраняем статус и API ключ
@@ -1983,8 +2049,7 @@ async def api_monitoring_deploy_tenant(request: Request, tenant_name: str):
         result = deploy_agent(ip, key_path, ssh_user, panel_url)
         return {"ip": ip, **result}
 
-    with ThreadPoolExecutor(max_workers=MAX_SSH_WORKERS) as executor:
-        results = list(executor.map(deploy_one, ips))
+    results = await asyncio.gather(*(run_ssh(deploy_one, ip) for ip in ips))
 
     # Сохраняем статусы
     monitoring = data.setdefault("monitoring", {})
@@ -2027,7 +2092,7 @@ async def api_monitoring_check_ip(request: Request, ip: str):
         return JSONResponse({"ok": False, "error": "SSH ключ не найден"}, status_code=400)
 
     ssh_user = get_ssh_user(data, ip)
-    result = check_ssh_reachable(ip, key_path, ssh_user)
+    result = await run_ssh(check_ssh_reachable, ip, key_path, ssh_user)
 
     # Сохраняем результат
     monitoring = data.setdefault("monitoring", {})
@@ -2063,8 +2128,7 @@ async def api_monitoring_check_tenant(request: Request, tenant_name: str):
         result = check_ssh_reachable(ip, key_path, ssh_user)
         return {"ip": ip, **result}
 
-    with ThreadPoolExecutor(max_workers=MAX_SSH_WORKERS) as executor:
-        results = list(executor.map(check_one, ips))
+    results = await asyncio.gather(*(run_ssh(check_one, ip) for ip in ips))
 
     # Сохраняем результаты
     monitoring = data.setdefault("monitoring", {})
@@ -2102,8 +2166,7 @@ async def api_monitoring_check_version_tenant(request: Request, tenant_name: str
         result = check_agent_version(ip, key_path, ssh_user)
         return {"ip": ip, **result}
 
-    with ThreadPoolExecutor(max_workers=MAX_SSH_WORKERS) as executor:
-        results = list(executor.map(check_one, ips))
+    results = await asyncio.gather(*(run_ssh(check_one, ip) for ip in ips))
 
     # Сохраняем версии в ip_status
     monitoring = data.setdefault("monitoring", {})
@@ -2140,7 +2203,7 @@ async def api_monitoring_collect_ip(request: Request, ip: str):
         return JSONResponse({"ok": False, "error": "SSH ключ не найден"}, status_code=400)
 
     ssh_user = get_ssh_user(data, ip)
-    result = trigger_agent(ip, key_path, ssh_user)
+    result = await run_ssh(trigger_agent, ip, key_path, ssh_user)
     return JSONResponse(result)
 
 
@@ -2162,8 +2225,7 @@ async def api_monitoring_collect_tenant(request: Request, tenant_name: str):
         ssh_user = get_ssh_user(data, ip)
         return {"ip": ip, **trigger_agent(ip, key_path, ssh_user)}
 
-    with ThreadPoolExecutor(max_workers=MAX_SSH_WORKERS) as executor:
-        results = list(executor.map(collect_one, ips))
+    results = await asyncio.gather(*(run_ssh(collect_one, ip) for ip in ips))
 
     ok_count = sum(1 for r in results if r.get("ok"))
     return JSONResponse({
@@ -2256,8 +2318,7 @@ async def api_monitoring_remove_all_agents(request: Request):
         ssh_user = get_ssh_user(data, ip)
         return {"ip": ip, **remove_agent(ip, key_path, ssh_user)}
 
-    with ThreadPoolExecutor(max_workers=MAX_SSH_WORKERS) as executor:
-        results = list(executor.map(remove_one, deployed_ips))
+    results = await asyncio.gather(*(run_ssh(remove_one, ip) for ip in deployed_ips))
 
     # Обновляем данные: убираем статусы агентов
     ok_count = 0
@@ -2437,7 +2498,9 @@ async def api_v1_found_ip(request: Request):
                 "attached": False,
                 "server_name": None,
             })
+            cached_ips.sort(key=lambda x: ip_sort_key(x.get("ip")))
             ip_count = len(cached_ips)
+            projects_cache[panel_project].update(count_ips(cached_ips))
 
     if ip_count >= MAX_FIP:
         action = "stop"
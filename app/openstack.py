@@ -1,24 +1,84 @@
 """
 OpenStack API функции для работы с VK Cloud.
 """
+import asyncio
 import logging
+import time
+from datetime import datetime
 from typing import Optional
 
 import httpx
+import orjson
 
 logger = logging.getLogger(__name__)
 
+# Общий HTTP клиент: keep-alive соединения к Keystone/Neutron/Nova
+# переиспользуются между запросами. Создаётся в lifespan приложения.
+_HTTP: Optional[httpx.AsyncClient] = None
 
-def openstack_auth(
+# Кэш токенов Keystone: (auth_url, username, project_id) -> (token, endpoints, project_name, expires_at)
+_token_cache: dict[tuple, tuple] = {}
+# Блокировка на ключ: параллельные промахи по одному проекту дают один POST /auth/tokens
+_token_locks: dict[tuple, asyncio.Lock] = {}
+
+# Обновляем токен заранее, за 5 минут до истечения
+TOKEN_EXPIRY_MARGIN = 300
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Сервисы каталога Keystone, которые нам нужны (остальные не разбираем)
+CATALOG_SERVICES = frozenset({"network", "compute"})
+
+
+def init_http_client() -> httpx.AsyncClient:
+    """Создать общий HTTP клиент (вызывается при старте приложения)."""
+    global _HTTP
+    if _HTTP is None:
+        _HTTP = httpx.AsyncClient(
+            http2=True,
+            timeout=30,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=200),
+            # API OpenStack не редиректит; редирект — признак неверного
+            # auth_url/endpoint, пусть лучше упадёт, чем уйдёт лишний запрос
+            follow_redirects=False,
+        )
+    return _HTTP
+
+
+def _client() -> httpx.AsyncClient:
+    """Общий HTTP клиент (создаётся лениво, если lifespan не отработал)."""
+    return _HTTP or init_http_client()
+
+
+async def close_http_client() -> None:
+    """Закрыть общий HTTP клиент (вызывается при остановке приложения)."""
+    global _HTTP
+    if _HTTP is not None:
+        await _HTTP.aclose()
+        _HTTP = None
+
+
+def _parse_expires_at(value: Optional[str]) -> float:
+    """Время истечения токена (ISO 8601 из Keystone) -> unix timestamp."""
+    if not value:
+        return 0.0
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def _auth_request(
     auth_url: str,
     username: str,
     password: str,
     project_id: str,
-) -> tuple[str, dict, str]:
+) -> tuple[str, bytes]:
     """
-    Получить токен OpenStack через Keystone.
-    
-    Возвращает (token, endpoints_dict, project_name).
+    URL и сериализованное тело POST /auth/tokens для проекта.
+
+    Не кэшируется: ключом кэша был бы пароль, а сборка тела
+    ничто по сравнению с самим HTTP запросом.
     """
     auth_payload = {
         "auth": {
@@ -37,51 +97,119 @@ def openstack_auth(
             },
         }
     }
+    return auth_url.rstrip("/") + "/auth/tokens", orjson.dumps(auth_payload)
+
 
-    token_url = auth_url.rstrip("/") + "/auth/tokens"
+async def openstack_auth(
+    auth_url: str,
+    username: str,
+    password: str,
+    project_id: str,
+) -> tuple[str, dict, str, float]:
+    """
+    Получить токен OpenStack через Keystone.
+    
+    Возвращает (token, endpoints_dict, project_name, expires_at).
+    """
+    token_url, body = _auth_request(auth_url, username, password, project_id)
 
-    with httpx.Client(timeout=30) as client:
-        resp = client.post(token_url, json=auth_payload)
-        resp.raise_for_status()
+    resp = await _client().post(token_url, content=body, headers=_JSON_HEADERS)
+    resp.raise_for_status()
 
-        token = resp.headers.get("X-Subject-Token")
-        catalog = resp.json().get("token", {}).get("catalog", [])
+    token = resp.headers.get("X-Subject-Token")
+    token_data = orjson.loads(resp.content).get("token", {})
+    catalog = token_data.get("catalog", [])
 
-        # Собираем endpoints (только RegionOne)
-        endpoints = {}
-        for service in catalog:
-            stype = service.get("type")
-            for ep in service.get("endpoints", []):
-                if ep.get("interface") == "public" and ep.get("region") == "RegionOne":
-                    endpoints[stype] = ep.get("url")
+    # Собираем endpoints (только RegionOne и только нужные сервисы).
+    # Результат живёт в кэше токенов вместе с токеном, так что каталог
+    # разбирается один раз за время жизни токена
+    endpoints = {}
+    for service in catalog:
+        stype = service.get("type")
+        if stype not in CATALOG_SERVICES:
+            continue
+        for ep in service.get("endpoints", []):
+            if ep.get("interface") == "public" and ep.get("region") == "RegionOne":
+                endpoints[stype] = ep.get("url")
 
-        # Имя проекта из ответа Keystone
-        project_name = resp.json().get("token", {}).get("project", {}).get("name", "")
+    # Имя проекта из ответа Keystone
+    project_name = token_data.get("project", {}).get("name", "")
 
-        return token, endpoints, project_name
+    return token, endpoints, project_name, _parse_expires_at(token_data.get("expires_at"))
 
 
-def openstack_get_floating_ips(token: str, network_endpoint: str) -> list[dict]:
+async def get_cached_token(
+    auth_url: str,
+    username: str,
+    password: str,
+    project_id: str,
+) -> tuple[str, dict, str]:
+    """
+    Токен Keystone из кэша или новый через openstack_auth.
+
+    Токен переиспользуется до expires_at минус TOKEN_EXPIRY_MARGIN.
+    Возвращает (token, endpoints_dict, project_name).
+    """
+    cache_key = (auth_url, username, project_id)
+    cached = _token_cache.get(cache_key)
+    if cached and cached[3] - TOKEN_EXPIRY_MARGIN > time.time():
+        return cached[:3]
+
+    async with _token_locks.setdefault(cache_key, asyncio.Lock()):
+        # Пока ждали блокировку, токен мог получить другой запрос
+        cached = _token_cache.get(cache_key)
+        if cached and cached[3] - TOKEN_EXPIRY_MARGIN > time.time():
+            return cached[:3]
+
+        cached = await openstack_auth(auth_url, username, password, project_id)
+        _token_cache[cache_key] = cached
+        return cached[:3]
+
+
+def invalidate_token(auth_url: str, username: str, project_id: str) -> None:
+    """Сбросить закэшированный токен (например, после 401 от API)."""
+    _token_cache.pop((auth_url, username, project_id), None)
+
+
+async def openstack_get_floating_ips(token: str, network_endpoint: str) -> list[dict]:
     """Получить список floating IPs через Neutron API."""
     url = network_endpoint.rstrip("/") + "/v2.0/floatingips"
 
-    with httpx.Client(timeout=30) as client:
-        resp = client.get(url, headers={"X-Auth-Token": token})
-        resp.raise_for_status()
-        return resp.json().get("floatingips", [])
+    resp = await _client().get(url, headers={"X-Auth-Token": token})
+    resp.raise_for_status()
+    return orjson.loads(resp.content).get("floatingips", [])
+
 
+async def openstack_get_servers(token: str, compute_endpoint: str) -> list[dict]:
+    """
+    Получить список серверов через Nova API.
 
-def openstack_get_servers(token: str, compute_endpoint: str) -> list[dict]:
-    """Получить список серверов через Nova API."""
+    Запрашиваем только name и addresses — остальное представление сервера
+    (flavor, image, metadata...) не используется. Если Nova не понимает
+    параметр fields, повторяем полный запрос.
+    """
     url = compute_endpoint.rstrip("/") + "/servers/detail"
+    headers = {"X-Auth-Token": token}
 
-    with httpx.Client(timeout=30) as client:
-        resp = client.get(url, headers={"X-Auth-Token": token})
-        resp.raise_for_status()
-        return resp.json().get("servers", [])
+    resp = await _client().get(url, params={"fields": "name,addresses"}, headers=headers)
+    if resp.status_code == 400:
+        resp = await _client().get(url, headers=headers)
+    resp.raise_for_status()
+    return orjson.loads(resp.content).get("servers", [])
+
+
+async def _get_servers_or_empty(token: str, compute_endpoint: Optional[str]) -> list[dict]:
+    """Серверы проекта; при ошибке — пустой список (маппинг на имена необязателен)."""
+    if not compute_endpoint:
+        return []
+    try:
+        return await openstack_get_servers(token, compute_endpoint)
+    except Exception as e:
+        logger.warning("Failed to get servers: %s", e)
+        return []
 
 
-def get_project_floating_ips(project: dict) -> dict:
+async def get_project_floating_ips(project: dict) -> dict:
     """
     Получить все floating IPs для проекта через OpenStack API.
     
@@ -100,7 +228,7 @@ def get_project_floating_ips(project: dict) -> dict:
     }
 
     try:
-        token, endpoints, os_project_name = openstack_auth(
+        token, endpoints, os_project_name = await get_cached_token(
             project["auth_url"],
             project["username"],
             project["password"],
@@ -116,46 +244,43 @@ def get_project_floating_ips(project: dict) -> dict:
             result["error"] = "No network endpoint"
             return result
 
-        # Получаем floating IPs
-        fips = openstack_get_floating_ips(token, network_ep)
-
-        # Получаем серверы для маппинга fixed_ip -> server_name
-        servers = []
-        if compute_ep:
-            try:
-                servers = openstack_get_servers(token, compute_ep)
-            except Exception as e:
-                logger.warning(f"Failed to get servers: {e}")
+        # Floating IPs и серверы (для маппинга fixed_ip -> server_name) —
+        # параллельно, по одному соединению
+        fips, servers = await asyncio.gather(
+            openstack_get_floating_ips(token, network_ep),
+            _get_servers_or_empty(token, compute_ep),
+        )
+        # Индекс fixed_ip -> имя сервера (один проход по адресам серверов).
+        # Если адрес встречается у нескольких серверов — берём первый
+        ip2name = {}
+        for srv in servers:
+            for network_addrs in srv.get("addresses", {}).values():
+                for addr in network_addrs:
+                    if addr.get("addr"):
+                        ip2name.setdefault(addr["addr"], srv.get("name"))
 
         # Собираем информацию по IP
         for fip in fips:
-            ip_info = {
+            fixed_ip = fip.get("fixed_ip_address")
+            result["ips"].append({
                 "ip": fip.get("floating_ip_address"),
                 "id": fip.get("id"),
                 "status": fip.get("status"),
-                "fixed_ip": fip.get("fixed_ip_address"),
+                "fixed_ip": fixed_ip,
                 "port_id": fip.get("port_id"),
                 "attached": bool(fip.get("port_id")),
-                "server_name": None,
-            }
-
-            # Ищем сервер по fixed_ip
-            fixed_ip = fip.get("fixed_ip_address")
-            if fixed_ip and servers:
-                for srv in servers:
-                    for network_addrs in srv.get("addresses", {}).values():
-                        for addr in network_addrs:
-                            if addr.get("addr") == fixed_ip:
-                                ip_info["server_name"] = srv.get("name")
-                                break
-
-            result["ips"].append(ip_info)
+                # Свободные IP (без fixed_ip) — большинство; их в индексе не ищем
+                "server_name": ip2name.get(fixed_ip) if fixed_ip else None,
+            })
 
     except httpx.HTTPStatusError as e:
+        if e.response.status_code == 401:
+            # Токен отозван раньше срока — при следующем обновлении получим новый
+            invalidate_token(project["auth_url"], project["username"], project["project_id"])
         result["error"] = f"HTTP {e.response.status_code}"
-        logger.error(f"OpenStack API error for {project['name']}: {e}")
+        logger.error("OpenStack API error for %s: %s", project["name"], e)
     except Exception as e:
         result["error"] = str(e)[:100]
-        logger.error(f"get_project_floating_ips failed for {project['name']}: {e}")
+        logger.error("get_project_floating_ips failed for %s: %s", project["name"], e)
 
     return result
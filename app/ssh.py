@@ -1,16 +1,146 @@
 """
 SSH функции для работы с серверами.
 """
-import json
+import io
 import logging
-from typing import Optional
-
+import re
+import select
+import shlex
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Iterator, Optional
+
+import orjson
 import paramiko
 
-from .config import SSH_TIMEOUT, SSH_COMMAND_TIMEOUT
+from . import ssh_mux
+from .config import (
+    SSH_TIMEOUT, SSH_COMMAND_TIMEOUT, SSH_MAX_OUTPUT, SSH_POOL_IDLE_TTL, STATUS_CACHE_TTL,
+    SSH_KNOWN_HOSTS, MAX_SSH_WORKERS,
+)
 
 logger = logging.getLogger(__name__)
 
+# OS_* переменные из .env — разбираем локально, без remote grep.
+# Значение — до конца строки (имя проекта может содержать пробелы)
+_ENV_RE = re.compile(r"^OS_(USERNAME|PROJECT_NAME|PROJECT_ID|AUTH_URL)=(.*)$", re.M)
+# Все OS_* переменные .env — окружение для openstack CLI
+_OS_ENV_RE = re.compile(r"^(OS_[A-Za-z0-9_]+)=(.*)$", re.M)
+_ENV_FIELDS = {
+    "USERNAME": "account",
+    "PROJECT_NAME": "project",
+    "PROJECT_ID": "project_id",
+    "AUTH_URL": "auth_url",
+}
+
+# Пул SSH подключений: (host, port, user) -> SSHClient
+_SSH_POOL: dict[tuple, paramiko.SSHClient] = {}
+# Блокировка на ключ — чтобы параллельные потоки не подключались дважды
+_SSH_LOCKS: dict[tuple, threading.Lock] = {}
+# Время последнего использования подключения (time.monotonic)
+_SSH_LAST_USED: dict[tuple, float] = {}
+# SFTP сессия на подключение — открывается один раз и живёт вместе с клиентом
+_SFTP_SESSIONS: "weakref.WeakKeyDictionary[paramiko.SSHClient, paramiko.SFTPClient]" = weakref.WeakKeyDictionary()
+
+# Ключи хостов, общие для всех подключений: known_hosts читается один раз,
+# ключи хостов не из файла запоминаются при первом подключении
+_HOST_KEYS: Optional[paramiko.HostKeys] = None
+_HOST_KEYS_LOCK = threading.Lock()
+
+# Разделители секций в выводе объединённой команды: несколько проверок
+# за один exec_command (один RTT) вместо отдельного вызова на каждую
+_ENV_MARKER = "---ENV---"
+_STATE_MARKER = "---STATE---"
+_SCRIPT_MARKER = "---SCRIPT---"
+
+# Правка .env на сервере: первый файл (stdin) — строки KEY=VALUE для замены,
+# второй — сам .env. Совпадающие ключи заменяются на KEY="VALUE",
+# комментарии и пустые строки не трогаются, отсутствующие ключи дописываются
+_ENV_UPDATE_AWK = (
+    'NR == FNR { i = index($0, "="); upd[substr($0, 1, i - 1)] = substr($0, i + 1); next } '
+    '{ line = $0; gsub(/^[ \\t]+|[ \\t]+$/, "", line); '
+    'if (line != "" && line !~ /^#/ && (i = index(line, "=")) > 0) { '
+    'k = substr(line, 1, i - 1); '
+    'if (k in upd) { print k "=\\"" upd[k] "\\""; seen[k] = 1; next } } '
+    'print } '
+    'END { for (k in upd) if (!(k in seen)) print k "=\\"" upd[k] "\\"" }'
+)
+
+# Символы, которые ломают строку KEY="VALUE" в .env
+_ENV_UNSAFE_CHARS = frozenset('"\\\n\r')
+
+# Короткий кэш статусов: (server name, script name) -> (expires_at, status).
+# Два запроса к одному скрипту в пределах STATUS_CACHE_TTL — один SSH вызов
+_STATUS_CACHE: dict[tuple[str, str], tuple[float, dict]] = {}
+
+
+def _marker(name: str) -> str:
+    """Shell-команда, печатающая разделитель секции с новой строки."""
+    return f"echo; echo {name}"
+
+
+def _split_section(out: bytes, name: str) -> tuple[bytes, Optional[bytes]]:
+    """
+    Разделить сырой вывод на (до разделителя, после разделителя).
+
+    Если разделителя нет (команда оборвалась раньше), вторая часть — None.
+    """
+    head, sep, tail = out.partition(f"\n{name}\n".encode())
+    return head, tail if sep else None
+
+
+@lru_cache(maxsize=1024)
+def _quote(value: str) -> str:
+    """shlex.quote с кэшем — имена сервисов и пути повторяются в каждом опросе."""
+    return shlex.quote(value)
+
+
+def quoted_service_name(script: dict) -> str:
+    """Имя systemd сервиса скрипта, готовое для подстановки в shell-команду."""
+    return _quote(script.get("service_name") or f"vkip-{script['name']}")
+
+
+def _unquote(value: str) -> str:
+    """Убрать пробелы по краям и одну пару обрамляющих кавычек."""
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+        return value[1:-1]
+    return value
+
+
+def _parse_env(text: str) -> dict:
+    """Достать account/project/project_id/auth_url из содержимого .env."""
+    result = {}
+    for key, value in _ENV_RE.findall(text):
+        value = _unquote(value)
+        if value:
+            result[_ENV_FIELDS[key]] = value
+    return result
+
+
+class _RememberHostKeyPolicy(paramiko.MissingHostKeyPolicy):
+    """Принять ключ незнакомого хоста и запомнить его в общих _HOST_KEYS."""
+
+    def missing_host_key(self, client, hostname, key):
+        with _HOST_KEYS_LOCK:
+            _HOST_KEYS.add(hostname, key.get_name(), key)
+        client.get_host_keys().add(hostname, key.get_name(), key)
+
+
+def _shared_host_keys() -> paramiko.HostKeys:
+    """Общие ключи хостов (SSH_KNOWN_HOSTS загружается при первом вызове)."""
+    global _HOST_KEYS
+    with _HOST_KEYS_LOCK:
+        if _HOST_KEYS is None:
+            _HOST_KEYS = paramiko.HostKeys()
+            if SSH_KNOWN_HOSTS:
+                _HOST_KEYS.load(SSH_KNOWN_HOSTS)
+        return _HOST_KEYS
+
 
 def ssh_connect(
     host: str,
@@ -21,7 +151,14 @@ def ssh_connect(
 ) -> paramiko.SSHClient:
     """Подключиться к серверу по SSH."""
     client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    # Ключи из общего набора — без чтения known_hosts на каждое подключение
+    host_keys = _shared_host_keys()
+    with _HOST_KEYS_LOCK:
+        client.get_host_keys().update(host_keys)
+    if SSH_KNOWN_HOSTS:
+        client.set_missing_host_key_policy(paramiko.RejectPolicy())
+    else:
+        client.set_missing_host_key_policy(_RememberHostKeyPolicy())
 
     try:
         if key_path:
@@ -36,7 +173,83 @@ def ssh_connect(
             )
         return client
     except Exception as e:
-        logger.error(f"SSH connect failed to {host}: {e}")
+        logger.error("SSH connect failed to %s: %s", host, e)
+        raise
+
+
+def _pool_key(server: dict) -> tuple:
+    """Ключ пула подключений для сервера."""
+    return server["host"], server.get("port", 22), server["user"]
+
+
+def get_pooled_client(server: dict) -> paramiko.SSHClient:
+    """
+    SSH клиент из пула для сервера (host, port, user).
+
+    Подключение переиспользуется между вызовами: paramiko мультиплексирует
+    каналы exec_command поверх одного Transport, так что рукопожатие
+    (TCP + KEX + auth) выполняется один раз. Переподключаемся, если
+    транспорт умер или подключение простаивало дольше SSH_POOL_IDLE_TTL.
+    """
+    key = _pool_key(server)
+    with _SSH_LOCKS.setdefault(key, threading.Lock()):
+        now = time.monotonic()
+        client = _SSH_POOL.get(key)
+        if client is not None:
+            transport = client.get_transport()
+            idle = now - _SSH_LAST_USED.get(key, now)
+            if transport is not None and transport.is_active() and idle < SSH_POOL_IDLE_TTL:
+                _SSH_LAST_USED[key] = now
+                return client
+            client.close()
+
+        client = ssh_connect(
+            server["host"],
+            server.get("port", 22),
+            server["user"],
+            server.get("password"),
+            server.get("key_path"),
+        )
+        # Keepalive, чтобы тихо оборванное соединение не висело в пуле
+        client.get_transport().set_keepalive(30)
+        _SSH_POOL[key] = client
+        _SSH_LAST_USED[key] = now
+        return client
+
+
+def evict_pooled_client(server: dict) -> None:
+    """Закрыть и убрать из пула подключение к серверу."""
+    key = _pool_key(server)
+    with _SSH_LOCKS.setdefault(key, threading.Lock()):
+        client = _SSH_POOL.pop(key, None)
+        _SSH_LAST_USED.pop(key, None)
+    if client is not None:
+        client.close()
+
+
+def _transport_alive(client: paramiko.SSHClient) -> bool:
+    """Жив ли транспорт подключения."""
+    transport = client.get_transport()
+    return transport is not None and transport.is_active()
+
+
+@contextmanager
+def pooled_ssh(server: dict) -> Iterator[paramiko.SSHClient]:
+    """
+    Подключение из пула на время блока.
+
+    Если в блоке упал сам транспорт (SSHException, OSError, EOFError
+    при неактивном транспорте), подключение выбрасывается из пула, чтобы
+    следующий вызов переподключился, а не получил полумёртвый клиент.
+    Тайм-аут медленной команды транспорт не рвёт — каналы других потоков
+    на том же подключении продолжают работать.
+    """
+    client = get_pooled_client(server)
+    try:
+        yield client
+    except (paramiko.SSHException, OSError, EOFError):
+        if not _transport_alive(client):
+            evict_pooled_client(server)
         raise
 
 
@@ -44,102 +257,437 @@ def ssh_exec(
     client: paramiko.SSHClient,
     cmd: str,
     timeout: int = SSH_COMMAND_TIMEOUT,
-) -> tuple[int, str, str]:
-    """Выполнить команду по SSH."""
+    decode: bool = True,
+    max_bytes: int = SSH_MAX_OUTPUT,
+    stdin_data: Optional[bytes] = None,
+) -> tuple[int, str | bytes, str | bytes]:
+    """
+    Выполнить команду по SSH.
+
+    decode=False возвращает stdout/stderr как bytes — для вывода, который
+    дальше идёт в orjson.loads, лишние decode/encode не нужны.
+    stdout больше max_bytes обрезается, канал закрывается, exit_code = -1.
+    stdin_data, если задан, передаётся команде на stdin.
+    """
     try:
         stdin, stdout, stderr = client.exec_command(cmd, timeout=timeout)
-        exit_code = stdout.channel.recv_exit_status()
-        return exit_code, stdout.read().decode(), stderr.read().decode()
+        channel = stdout.channel
+        if stdin_data is not None:
+            stdin.write(stdin_data)
+            channel.shutdown_write()
+
+        # Читаем stdout кусками прямо из канала в один буфер
+        buf = bytearray()
+        truncated = False
+        while True:
+            chunk = channel.recv(65536)
+            if not chunk:
+                break
+            if len(buf) + len(chunk) > max_bytes:
+                buf += chunk[:max_bytes - len(buf)]
+                truncated = True
+                break
+            buf += chunk
+
+        if truncated:
+            channel.close()
+            logger.warning("SSH output truncated at %d bytes: %.50s...", max_bytes, cmd)
+            exit_code, err = -1, b""
+        else:
+            err = stderr.read()
+            exit_code = channel.recv_exit_status()
+
+        out = bytes(buf)
+        if decode:
+            return exit_code, out.decode(errors="replace"), err.decode(errors="replace")
+        return exit_code, out, err
     except Exception as e:
-        logger.error(f"SSH exec failed: {cmd[:50]}... - {e}")
+        logger.error("SSH exec failed: %.50s... - %s", cmd, e)
         raise
 
 
+def run_command(
+    server: dict,
+    cmd: str,
+    timeout: int = SSH_COMMAND_TIMEOUT,
+    decode: bool = True,
+) -> tuple[int, str | bytes, str | bytes]:
+    """
+    Выполнить команду на сервере.
+
+    Через ssh ControlMaster, если он включён для сервера (VKPANEL_SSH_MUX),
+    иначе через подключение из пула paramiko.
+    """
+    if ssh_mux.enabled_for(server):
+        return ssh_mux.run(server, cmd, timeout, decode)
+    with pooled_ssh(server) as client:
+        return ssh_exec(client, cmd, timeout, decode)
+
+
+def ssh_exec_many(
+    jobs: list[tuple[paramiko.SSHClient, str]],
+    timeout: int = SSH_COMMAND_TIMEOUT,
+    max_bytes: int = SSH_MAX_OUTPUT,
+) -> list[tuple[int, bytes, bytes] | Exception]:
+    """
+    Выполнить команды на нескольких подключениях одновременно.
+
+    Каналы открываются сразу для всех пар (client, cmd), вывод вычитывается
+    одним циклом select() по их fileno(), так что общее время — max(t_i),
+    а не сумма, и без потока на каждый хост.
+    Возвращает для каждой пары (exit_code, stdout, stderr) в bytes или
+    исключение, с которым упала именно она. Обрезка по max_bytes — как в ssh_exec,
+    stderr обрезается тем же лимитом.
+    """
+    results: list[tuple[int, bytes, bytes] | Exception | None] = [None] * len(jobs)
+    channels: dict[paramiko.Channel, int] = {}
+    bufs: list[bytearray] = [bytearray() for _ in jobs]
+    errs: list[bytearray] = [bytearray() for _ in jobs]
+
+    for i, (client, cmd) in enumerate(jobs):
+        try:
+            channel = client.get_transport().open_session(timeout=timeout)
+            channel.exec_command(cmd)
+            channel.setblocking(False)
+            channels[channel] = i
+        except Exception as e:
+            logger.error("SSH exec failed: %.50s... - %s", cmd, e)
+            results[i] = e
+
+    deadline = time.monotonic() + timeout
+    while channels:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        # Короткий тайм-аут: exit status может прийти без события на fileno()
+        readable, _, _ = select.select(list(channels), [], [], min(remaining, 0.5))
+        for channel in readable or list(channels):
+            i = channels[channel]
+            try:
+                while channel.recv_ready():
+                    bufs[i] += channel.recv(65536)
+                while channel.recv_stderr_ready():
+                    errs[i] += channel.recv_stderr(65536)
+                    del errs[i][max_bytes:]
+            except Exception as e:
+                results[i] = e
+                channel.close()
+                del channels[channel]
+                continue
+
+            if len(bufs[i]) > max_bytes:
+                del bufs[i][max_bytes:]
+                logger.warning("SSH output truncated at %d bytes: %.50s...", max_bytes, jobs[i][1])
+                results[i] = (-1, bytes(bufs[i]), b"")
+            elif channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+                results[i] = (channel.recv_exit_status(), bytes(bufs[i]), bytes(errs[i]))
+            else:
+                continue
+            channel.close()
+            del channels[channel]
+
+    for channel, i in channels.items():
+        channel.close()
+        logger.error("SSH exec timed out: %.50s...", jobs[i][1])
+        results[i] = TimeoutError(f"Command timed out after {timeout}s")
+    return results
+
+
+def get_sftp(client: paramiko.SSHClient) -> paramiko.SFTPClient:
+    """SFTP сессия поверх подключения (кэшируется на клиенте)."""
+    sftp = _SFTP_SESSIONS.get(client)
+    if sftp is None or sftp.sock.closed:
+        sftp = client.open_sftp()
+        _SFTP_SESSIONS[client] = sftp
+    return sftp
+
+
+def read_remote_file(client: paramiko.SSHClient, path: str) -> bytes:
+    """
+    Прочитать файл с сервера через SFTP.
+
+    В отличие от `cat` через exec_command не запускает удалённый shell.
+    FileNotFoundError пробрасывается вызывающему.
+    """
+    buf = io.BytesIO()
+    get_sftp(client).getfo(path, buf)
+    return buf.getvalue()
+
+
+def write_remote_file(client: paramiko.SSHClient, path: str, text: str) -> None:
+    """
+    Записать текстовый файл на сервер через SFTP (с завершающим переводом строки).
+
+    Содержимое не проходит через shell — экранирование не нужно.
+    """
+    if not text.endswith("\n"):
+        text += "\n"
+    with get_sftp(client).open(path, "wb") as f:
+        f.write(text.encode())
+
+
+def _empty_status() -> dict:
+    """Статус скрипта по умолчанию (до опроса)."""
+    return {
+        "running": False,
+        "substate": None,
+        "main_pid": None,
+        "error": None,
+        "cycles": 0,
+        "success": 0,
+        "errors": 0,
+        "last_ip": None,
+        "account": None,
+        "project": None,
+        "project_id": None,
+        "auth_url": None,
+    }
+
+
+def _status_command(script: dict) -> str:
+    """Статус systemd сервиса, .env и state файл скрипта — одной командой."""
+    service_name = quoted_service_name(script)
+    env_file = _quote(f"{script['path']}/.env")
+    state_file = _quote(script.get("state_file", f"{script['path']}/vk_fip_state.json"))
+    return (
+        f"systemctl show -p ActiveState,SubState,MainPID {service_name}; "
+        f"{_marker(_ENV_MARKER)}; cat {env_file} 2>/dev/null; "
+        f"{_marker(_STATE_MARKER)}; cat {state_file} 2>/dev/null"
+    )
+
+
+def _parse_status_output(out: bytes) -> dict:
+    """Разобрать сырой вывод _status_command в dict статуса."""
+    result = _empty_status()
+
+    unit_out, rest = _split_section(out, _ENV_MARKER)
+    env_out, state_out = _split_section(rest or b"", _STATE_MARKER)
+    # systemctl show: строки Key=Value в своём порядке
+    unit = dict(
+        line.partition("=")[::2]
+        for line in unit_out.decode(errors="replace").splitlines()
+        if "=" in line
+    )
+    result["running"] = unit.get("ActiveState") == "active"
+    result["substate"] = unit.get("SubState") or None
+    main_pid = unit.get("MainPID", "")
+    result["main_pid"] = int(main_pid) if main_pid.isdigit() and main_pid != "0" else None
+    if state_out is None:
+        # Нет секции — её содержимое неизвестно, а не пустое
+        result["error"] = "Incomplete status output"
+        state_out = b""
+
+    # OS_USERNAME, OS_PROJECT_NAME, OS_PROJECT_ID, OS_AUTH_URL из .env
+    result.update(_parse_env(env_out.decode(errors="replace")))
+
+    # State файл
+    if state_out.strip():
+        try:
+            result.update(_summarize_state(orjson.loads(state_out)))
+        except orjson.JSONDecodeError as e:
+            logger.warning("Failed to parse state file: %s", e)
+
+    return result
+
+
+def _summarize_state(state: dict) -> dict:
+    """
+    Счётчики из state файла скрипта: cycles, success, errors, last_ip.
+
+    Сам state в статус не попадает — из него нужны только эти поля,
+    а держать целиком распарсенный файл в кэшах статусов незачем.
+    """
+    meta = state.get("meta", {})
+
+    # Все счётчики по подсетям — за один проход
+    total_success = 0
+    total_errors = 0
+    for s in meta.get("stats", {}).values():
+        total_success += s.get("success", 0)
+        total_errors += s.get("errors", 0)
+
+    # Последний пойманный IP — самый свежий среди хвостов подсетей
+    candidates = [ips[-1] for ips in state.get("allocated", {}).values() if ips]
+    latest = max(candidates, key=lambda x: x.get("created_at") or "", default=None)
+
+    return {
+        "cycles": meta.get("cycle_no", 0),
+        "success": total_success,
+        "errors": total_errors,
+        "last_ip": latest.get("floating_ip") if latest else None,
+    }
+
+
+def _status_key(server: dict, script: dict) -> tuple[str, str]:
+    return server["name"], script["name"]
+
+
+def _remember_status(server: dict, script: dict, status: dict) -> None:
+    """Запомнить статус скрипта на STATUS_CACHE_TTL (ошибки не кэшируем)."""
+    if status["error"] is None:
+        _STATUS_CACHE[_status_key(server, script)] = (time.monotonic() + STATUS_CACHE_TTL, status)
+
+
+def invalidate_status(server: dict, script: dict) -> None:
+    """Сбросить закэшированный статус скрипта (после start/stop/смены проекта)."""
+    _STATUS_CACHE.pop(_status_key(server, script), None)
+
+
 def get_script_status(server: dict, script: dict) -> dict:
     """
     Получить статус скрипта через SSH.
     
     Возвращает dict с полями:
     - running: bool
+    - substate: str | None (SubState юнита: running, dead, failed, ...)
+    - main_pid: int | None
     - cycles: int
     - success: int
+    - errors: int
     - last_ip: str | None
     - account: str | None
     - project: str | None
+    - project_id: str | None
+    - auth_url: str | None
     - error: str | None
+
+    Результат кэшируется на STATUS_CACHE_TTL секунд.
     """
-    result = {
-        "running": False,
-        "error": None,
-        "state": None,
-        "cycles": 0,
-        "success": 0,
-        "last_ip": None,
-        "account": None,
-        "project": None,
-    }
+    cached = _STATUS_CACHE.get(_status_key(server, script))
+    if cached and cached[0] > time.monotonic():
+        return dict(cached[1])
 
-    client = None
     try:
-        client = ssh_connect(
-            server["host"],
-            server.get("port", 22),
-            server["user"],
-            server.get("password"),
-            server.get("key_path"),
-        )
+        code, out, err = run_command(server, _status_command(script), decode=False)
+        result = _parse_status_output(out)
+        _remember_status(server, script, result)
+        return dict(result)
+    except Exception as e:
+        logger.error("get_script_status failed for %s/%s: %s", server.get("name"), script.get("name"), e)
+        result = _empty_status()
+        result["error"] = str(e)
+        return result
 
-        # Проверяем статус systemd сервиса
-        service_name = script.get("service_name", f"vkip-{script['name']}")
-        code, out, err = ssh_exec(client, f"systemctl is-active {service_name}")
-        result["running"] = out.strip() == "active"
 
-        # Читаем OS_USERNAME и OS_PROJECT_NAME из .env
-        env_file = f"{script['path']}/.env"
-        code, out, err = ssh_exec(
-            client,
-            f"grep -E '^OS_USERNAME=|^OS_PROJECT_NAME=' {env_file} 2>/dev/null"
-        )
-        if code == 0 and out.strip():
-            for line in out.strip().split("\n"):
-                if line.startswith("OS_USERNAME="):
-                    result["account"] = line.split("=", 1)[1].strip().strip('"').strip("'")
-                elif line.startswith("OS_PROJECT_NAME="):
-                    result["project"] = line.split("=", 1)[1].strip().strip('"').strip("'")
-
-        # Читаем state файл
-        state_file = script.get("state_file", f"{script['path']}/vk_fip_state.json")
-        code, out, err = ssh_exec(client, f"cat {state_file} 2>/dev/null")
-
-        if code == 0 and out.strip():
-            try:
-                state = json.loads(out)
-                result["state"] = state
+def _host_status_command(scripts: list[dict]) -> str:
+    """Команды статуса скриптов одного хоста, склеенные через _SCRIPT_MARKER."""
+    return "; ".join(
+        f"{_status_command(script)}; {_marker(_SCRIPT_MARKER)}" for script in scripts
+    )
+
+
+def _failed_statuses(scripts: list[dict], error: Exception) -> list[dict]:
+    """Статусы скриптов хоста, опрос которого упал целиком."""
+    results = [_empty_status() for _ in scripts]
+    for result in results:
+        result["error"] = str(error)
+    return results
+
+
+def _parse_host_statuses(server: dict, scripts: list[dict], out: bytes) -> list[dict]:
+    """Разобрать вывод _host_status_command в статусы (в порядке scripts)."""
+    chunks = out.split(f"\n{_SCRIPT_MARKER}\n".encode())
+    results = []
+    for i, script in enumerate(scripts):
+        if i < len(chunks) - 1:
+            result = _parse_status_output(chunks[i])
+            _remember_status(server, script, result)
+            results.append(dict(result))
+        else:
+            # Вывод оборвался раньше, чем дошёл до этого скрипта
+            result = _empty_status()
+            result["error"] = "Incomplete status output"
+            logger.error("Incomplete status output for %s/%s", server.get("name"), script.get("name"))
+            results.append(result)
+    return results
 
-                meta = state.get("meta", {})
-                result["cycles"] = meta.get("cycle_no", 0)
 
-                stats = meta.get("stats", {})
-                total_success = sum(s.get("success", 0) for s in stats.values())
-                result["success"] = total_success
+def get_host_script_statuses(server: dict, scripts: list[dict]) -> list[dict]:
+    """
+    Статусы всех скриптов сервера за один exec_command.
 
-                # Последний пойманный IP
-                allocated = state.get("allocated", {})
-                for subnet_ips in allocated.values():
-                    if subnet_ips:
-                        last = subnet_ips[-1]
-                        result["last_ip"] = last.get("floating_ip")
-            except json.JSONDecodeError as e:
-                logger.warning(f"Failed to parse state file: {e}")
+    Команды отдельных скриптов склеиваются через разделитель _SCRIPT_MARKER,
+    так что на хост уходит один RTT вместо одного на каждый скрипт.
+    Возвращает статусы в порядке scripts (формат как у get_script_status).
+    """
+    if not scripts:
+        return []
 
+    try:
+        code, out, err = run_command(server, _host_status_command(scripts), decode=False)
     except Exception as e:
-        result["error"] = str(e)
-        logger.error(f"get_script_status failed for {server.get('name')}/{script.get('name')}: {e}")
-    finally:
-        if client:
-            client.close()
+        logger.error("get_host_script_statuses failed for %s: %s", server.get("name"), e)
+        return _failed_statuses(scripts, e)
 
-    return result
+    return _parse_host_statuses(server, scripts, out)
+
+
+def bulk_get_script_status(
+    pairs: list[tuple[dict, dict]],
+    max_workers: int = MAX_SSH_WORKERS,
+) -> list[dict]:
+    """
+    Статусы многих скриптов сразу.
+
+    Пары (server, script) группируются по хосту: на каждый хост — одна
+    объединённая команда. Подключения из пула берутся параллельно
+    (max_workers потоков), сами команды выполняются через ssh_exec_many
+    одним циклом select по всем каналам. Хосты с ssh ControlMaster
+    опрашиваются через get_host_script_statuses.
+    Возвращает статусы в порядке pairs.
+    """
+    by_host: dict[tuple, list[int]] = {}
+    for i, (server, _) in enumerate(pairs):
+        by_host.setdefault(_pool_key(server), []).append(i)
+
+    results: list[Optional[dict]] = [None] * len(pairs)
+
+    def store(indexes: list[int], statuses: list[dict]) -> None:
+        for i, status in zip(indexes, statuses):
+            results[i] = status
+
+    def connect(indexes: list[int]) -> paramiko.SSHClient | Exception:
+        try:
+            return get_pooled_client(pairs[indexes[0]][0])
+        except Exception as e:
+            return e
+
+    mux_hosts = [ix for ix in by_host.values() if ssh_mux.enabled_for(pairs[ix[0]][0])]
+    pool_hosts = [ix for ix in by_host.values() if not ssh_mux.enabled_for(pairs[ix[0]][0])]
+
+    workers = max(1, min(max_workers, len(by_host)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ssh-bulk") as executor:
+        mux_statuses = executor.map(
+            lambda ix: get_host_script_statuses(pairs[ix[0]][0], [pairs[i][1] for i in ix]),
+            mux_hosts,
+        )
+        clients = list(executor.map(connect, pool_hosts))
+
+        jobs = []
+        job_hosts = []
+        for indexes, client in zip(pool_hosts, clients):
+            scripts = [pairs[i][1] for i in indexes]
+            if isinstance(client, Exception):
+                store(indexes, _failed_statuses(scripts, client))
+            else:
+                jobs.append((client, _host_status_command(scripts)))
+                job_hosts.append(indexes)
+
+        for (client, _), indexes, outcome in zip(jobs, job_hosts, ssh_exec_many(jobs)):
+            server = pairs[indexes[0]][0]
+            scripts = [pairs[i][1] for i in indexes]
+            if isinstance(outcome, Exception):
+                logger.error("bulk_get_script_status failed for %s: %s", server.get("name"), outcome)
+                # Тайм-аут медленного хоста — не повод рвать живой транспорт
+                if not _transport_alive(client):
+                    evict_pooled_client(server)
+                store(indexes, _failed_statuses(scripts, outcome))
+            else:
+                store(indexes, _parse_host_statuses(server, scripts, outcome[1]))
+
+        for indexes, statuses in zip(mux_hosts, mux_statuses):
+            store(indexes, statuses)
+    return results
 
 
 def control_script(server: dict, script: dict, action: str) -> tuple[bool, str]:
@@ -151,33 +699,66 @@ def control_script(server: dict, script: dict, action: str) -> tuple[bool, str]:
     if action not in ("start", "stop", "restart"):
         return False, f"Invalid action: {action}"
 
-    client = None
     try:
-        client = ssh_connect(
-            server["host"],
-            server.get("port", 22),
-            server["user"],
-            server.get("password"),
-            server.get("key_path"),
-        )
-
-        service_name = script.get("service_name", f"vkip-{script['name']}")
-        code, out, err = ssh_exec(client, f"systemctl {action} {service_name}")
+        code, out, err = run_command(server, f"systemctl {action} {quoted_service_name(script)}")
+        # Состояние сервиса поменялось (или могло) — старый статус неверен
+        invalidate_status(server, script)
 
         if code == 0:
-            logger.info(f"Script {action}: {server['name']}/{script['name']} - OK")
+            logger.info("Script %s: %s/%s - OK", action, server["name"], script["name"])
             return True, f"Service {action} OK"
         else:
             error_msg = err.strip() or out.strip() or f"Exit code {code}"
-            logger.error(f"Script {action} failed: {server['name']}/{script['name']} - {error_msg}")
+            logger.error("Script %s failed: %s/%s - %s", action, server["name"], script["name"], error_msg)
             return False, error_msg
 
     except Exception as e:
-        logger.error(f"control_script failed: {server.get('name')}/{script.get('name')} - {e}")
+        logger.error("control_script failed: %s/%s - %s", server.get("name"), script.get("name"), e)
         return False, str(e)
-    finally:
-        if client:
-            client.close()
+
+
+def control_scripts_bulk(server: dict, scripts: list[dict], action: str) -> list[tuple[bool, str, dict]]:
+    """
+    start/stop/restart нескольких скриптов сервера за один SSH вызов.
+
+    systemctl получает все юниты сразу, в той же команде снимаются статусы
+    скриптов (они же попадают в кэш статусов). Успех каждого скрипта —
+    по его итоговому состоянию. Возвращает (success, message, status) в порядке scripts.
+    """
+    if action not in ("start", "stop", "restart"):
+        error = ValueError(f"Invalid action: {action}")
+        return [(False, str(error), status) for status in _failed_statuses(scripts, error)]
+    if not scripts:
+        return []
+
+    services = " ".join(quoted_service_name(script) for script in scripts)
+    cmd = f"systemctl {action} {services} 2>&1; {_marker(_SCRIPT_MARKER)}; {_host_status_command(scripts)}"
+    try:
+        for script in scripts:
+            invalidate_status(server, script)
+        code, out, err = run_command(server, cmd, decode=False)
+    except Exception as e:
+        logger.error("control_scripts_bulk failed: %s - %s", server.get("name"), e)
+        return [(False, str(e), status) for status in _failed_statuses(scripts, e)]
+
+    systemctl_out, rest = _split_section(out, _SCRIPT_MARKER)
+    systemctl_msg = systemctl_out.decode(errors="replace").strip()
+    statuses = _parse_host_statuses(server, scripts, rest or b"")
+
+    results = []
+    for script, status in zip(scripts, statuses):
+        if status["error"] is not None:
+            results.append((False, status["error"], status))
+        elif status["running"] == (action != "stop"):
+            results.append((True, f"Service {action} OK", status))
+        else:
+            error_msg = systemctl_msg or f"Service is {status['substate'] or 'unknown'}"
+            logger.error("Script %s failed: %s/%s - %s", action, server["name"], script["name"], error_msg)
+            results.append((False, error_msg, status))
+
+    ok = sum(1 for success, _, _ in results if success)
+    logger.info("Scripts %s: %s - %d/%d OK", action, server["name"], ok, len(scripts))
+    return results
 
 
 def get_floating_ips_via_cli(server: dict, script: dict) -> dict:
@@ -188,6 +769,8 @@ def get_floating_ips_via_cli(server: dict, script: dict) -> dict:
     - ips: list[dict]
     - account: str | None
     - project: str | None
+    - project_id: str | None
+    - auth_url: str | None
     - error: str | None
     """
     result = {
@@ -195,64 +778,58 @@ def get_floating_ips_via_cli(server: dict, script: dict) -> dict:
         "error": None,
         "account": None,
         "project": None,
+        "project_id": None,
+        "auth_url": None,
     }
 
-    client = None
     try:
-        client = ssh_connect(
-            server["host"],
-            server.get("port", 22),
-            server["user"],
-            server.get("password"),
-            server.get("key_path"),
-        )
-
-        env_file = f"{script['path']}/.env"
-
-        # Получаем floating ip list через openstack CLI
-        cmd = (
-            f"cd {script['path']} && "
-            f"export $(grep -E '^OS_' .env | grep -v '#' | xargs) && "
-            f"openstack floating ip list -f json 2>&1"
-        )
-        code, out, err = ssh_exec(client, cmd, timeout=60)
-
-        # Получаем account/project
-        code2, env_out, _ = ssh_exec(
-            client,
-            f"grep -E '^OS_USERNAME=|^OS_PROJECT_NAME=' {env_file} 2>/dev/null"
-        )
-        if code2 == 0 and env_out.strip():
-            for line in env_out.strip().split("\n"):
-                if line.startswith("OS_USERNAME="):
-                    result["account"] = line.split("=", 1)[1].strip().strip('"').strip("'")
-                elif line.startswith("OS_PROJECT_NAME="):
-                    result["project"] = line.split("=", 1)[1].strip().strip('"').strip("'")
-
-        if code == 0 and out.strip():
+        with pooled_ssh(server) as client:
             try:
-                ips_data = json.loads(out)
-                for ip in ips_data:
-                    result["ips"].append({
-                        "ip": ip.get("Floating IP Address"),
-                        "id": ip.get("ID"),
-                        "status": ip.get("Status"),
-                        "fixed_ip": ip.get("Fixed IP Address"),
-                        "port_id": ip.get("Port"),
-                        "attached": bool(ip.get("Port") or ip.get("Fixed IP Address")),
-                    })
-            except json.JSONDecodeError as e:
-                result["error"] = f"JSON parse error: {e}"
-                logger.error(f"Failed to parse openstack output: {e}")
-        elif err:
-            result["error"] = err[:200]
+                env_text = read_remote_file(client, f"{script['path']}/.env").decode(errors="replace")
+            except IOError as e:
+                result["error"] = f"Failed to read .env: {e}"
+                return result
+
+            # account/project/project_id/auth_url
+            result.update(_parse_env(env_text))
+
+            # .env не исполняем (в значениях бывают $, ` и кавычки):
+            # OS_* переменные разобраны здесь и уходят на stdin bash
+            # готовыми export строками с экранированием
+            exports = "".join(
+                f"export {key}={shlex.quote(_unquote(value))}\n"
+                for key, value in _OS_ENV_RE.findall(env_text)
+            )
+            script_text = (
+                f"{exports}"
+                f"cd {shlex.quote(script['path'])} && "
+                f"openstack floating ip list -f json 2>&1\n"
+            )
+            code, out, err = ssh_exec(
+                client, "bash -s", timeout=60, decode=False, stdin_data=script_text.encode()
+            )
+
+            if code == 0 and out.strip():
+                try:
+                    ips_data = orjson.loads(out)
+                    for ip in ips_data:
+                        result["ips"].append({
+                            "ip": ip.get("Floating IP Address"),
+                            "id": ip.get("ID"),
+                            "status": ip.get("Status"),
+                            "fixed_ip": ip.get("Fixed IP Address"),
+                            "port_id": ip.get("Port"),
+                            "attached": bool(ip.get("Port") or ip.get("Fixed IP Address")),
+                        })
+                except orjson.JSONDecodeError as e:
+                    result["error"] = f"JSON parse error: {e}"
+                    logger.error("Failed to parse openstack output: %s", e)
+            elif err:
+                result["error"] = err[:200].decode(errors="replace")
 
     except Exception as e:
         result["error"] = str(e)
-        logger.error(f"get_floating_ips_via_cli failed: {e}")
-    finally:
-        if client:
-            client.close()
+        logger.error("get_floating_ips_via_cli failed: %s", e)
 
     return result
 
@@ -271,81 +848,56 @@ def change_script_project(server: dict, script: dict, project: dict) -> tuple[bo
     Returns:
         (success, message)
     """
-    client = None
-    try:
-        client = ssh_connect(
-            server["host"],
-            server.get("port", 22),
-            server["user"],
-            server.get("password"),
-            server.get("key_path"),
-        )
+    env_file = shlex.quote(f"{script['path']}/.env")
+    service_name = quoted_service_name(script)
+
+    updates = {
+        "OS_USERNAME": project["username"],
+        "OS_PASSWORD": project["password"],
+        "OS_PROJECT_ID": project["project_id"],
+        "OS_PROJECT_NAME": project.get("os_project_name") or project["name"],
+    }
 
-        env_file = f"{script['path']}/.env"
-        service_name = script.get("service_name", f"vkip-{script['name']}")
+    # Если есть auth_url, обновляем и его
+    if project.get("auth_url"):
+        updates["OS_AUTH_URL"] = project["auth_url"]
+
+    for key, value in updates.items():
+        if _ENV_UNSAFE_CHARS.intersection(str(value)):
+            return False, f"Unsupported characters in {key} (quotes, backslashes and newlines are not allowed)"
+
+    # Чтение, правка и запись .env и перезапуск — одной командой.
+    # Значения идут через stdin (не в командной строке — там их видно в ps),
+    # cp -p сохраняет права .env, mv подменяет файл атомарно
+    cmd = (
+        f"[ -f {env_file} ] || exit 2; "
+        f"cp -p {env_file} {env_file}.new "
+        f"&& awk '{_ENV_UPDATE_AWK}' - {env_file} > {env_file}.new "
+        f"&& mv {env_file}.new {env_file} || exit 3; "
+        f"systemctl restart {service_name} || exit 4"
+    )
+    stdin_data = "".join(f"{key}={value}\n" for key, value in updates.items()).encode()
 
-        # Читаем текущий .env
-        code, current_env, err = ssh_exec(client, f"cat {env_file}")
-        if code != 0:
-            return False, f"Failed to read .env: {err}"
-
-        # Обновляем переменные
-        new_lines = []
-        updated_keys = set()
-        
-        updates = {
-            "OS_USERNAME": project["username"],
-            "OS_PASSWORD": project["password"],
-            "OS_PROJECT_ID": project["project_id"],
-            "OS_PROJECT_NAME": project.get("os_project_name") or project["name"],
-        }
-        
-        # Если есть auth_url, обновляем и его
-        if project.get("auth_url"):
-            updates["OS_AUTH_URL"] = project["auth_url"]
-
-        for line in current_env.split("\n"):
-            line_stripped = line.strip()
-            if not line_stripped or line_stripped.startswith("#"):
-                new_lines.append(line)
-                continue
-            
-            # Проверяем, нужно ли обновить эту строку
-            key = line_stripped.split("=")[0] if "=" in line_stripped else None
-            if key in updates:
-                new_lines.append(f'{key}="{updates[key]}"')
-                updated_keys.add(key)
-            else:
-                new_lines.append(line)
-        
-        # Добавляем отсутствующие ключи
-        for key, value in updates.items():
-            if key not in updated_keys:
-                new_lines.append(f'{key}="{value}"')
-
-        new_env = "\n".join(new_lines)
-
-        # Записываем новый .env
-        # Экранируем для bash
-        escaped_env = new_env.replace("'", "'\\''")
-        code, out, err = ssh_exec(client, f"echo '{escaped_env}' > {env_file}")
-        if code != 0:
-            return False, f"Failed to write .env: {err}"
+    try:
+        with pooled_ssh(server) as client:
+            code, out, err = ssh_exec(client, cmd, stdin_data=stdin_data)
+        invalidate_status(server, script)
 
-        # Перезапускаем скрипт
-        code, out, err = ssh_exec(client, f"systemctl restart {service_name}")
-        if code != 0:
+        if code == 2:
+            return False, "Failed to read .env: file not found"
+        if code == 3:
+            return False, f"Failed to write .env: {err}"
+        if code == 4:
             return False, f"Failed to restart service: {err}"
+        if code != 0:
+            return False, f"Exit code {code}: {err}"
 
-        logger.info(f"Changed project for {server['name']}/{script['name']} to {project['name']}")
+        logger.info("Changed project for %s/%s to %s", server["name"], script["name"], project["name"])
         return True, f"Проект изменён на {project['name']}, скрипт перезапущен"
 
     except Exception as e:
-        logger.error(f"change_script_project failed: {e}")
+        logger.error("change_script_project failed: %s", e)
         return False, str(e)
-    finally:
-        if client:
-            client.close()
 
 
 def update_script_subnets(server: dict, script: dict, subnets_json_str: str) -> tuple[bool, str]:
@@ -360,63 +912,52 @@ def update_script_subnets(server: dict, script: dict, subnets_json_str: str) ->
     Returns:
         (success, message)
     """
-    client = None
     try:
-        client = ssh_connect(
-            server["host"],
-            server.get("port", 22),
-            server["user"],
-            server.get("password"),
-            server.get("key_path"),
-        )
-
-        env_file = f"{script['path']}/.env"
-
-        # Читаем текущий .env
-        code, current_env, err = ssh_exec(client, f"cat {env_file}")
-        if code != 0:
-            return False, f"Failed to read .env: {err}"
+        with pooled_ssh(server) as client:
+            env_file = f"{script['path']}/.env"
 
-        # Считаем CYCLE: 30 сек на подсеть
-        import json as _json
-        num_subnets = len(_json.loads(subnets_json_str))
-        cycle_seconds = num_subnets * 30
-
-        # Обновляем/добавляем SUBNETS_JSON и CYCLE
-        new_lines = []
-        found_subnets = False
-        found_cycle = False
-
-        for line in current_env.split("\n"):
-            line_stripped = line.strip()
-            if line_stripped.startswith("SUBNETS_JSON="):
+            # Читаем текущий .env
+            try:
+                current_env = read_remote_file(client, env_file).decode()
+            except IOError as e:
+                return False, f"Failed to read .env: {e}"
+
+            # Считаем CYCLE: 30 сек на подсеть
+            num_subnets = len(orjson.loads(subnets_json_str))
+            cycle_seconds = num_subnets * 30
+
+            # Обновляем/добавляем SUBNETS_JSON и CYCLE
+            new_lines = []
+            found_subnets = False
+            found_cycle = False
+
+            for line in current_env.split("\n"):
+                line_stripped = line.strip()
+                if line_stripped.startswith("SUBNETS_JSON="):
+                    new_lines.append(f"SUBNETS_JSON='{subnets_json_str}'")
+                    found_subnets = True
+                elif line_stripped.startswith("CYCLE="):
+                    new_lines.append(f"CYCLE={cycle_seconds}")
+                    found_cycle = True
+                else:
+                    new_lines.append(line)
+
+            if not found_subnets:
                 new_lines.append(f"SUBNETS_JSON='{subnets_json_str}'")
-                found_subnets = True
-            elif line_stripped.startswith("CYCLE="):
+            if not found_cycle:
                 new_lines.append(f"CYCLE={cycle_seconds}")
-                found_cycle = True
-            else:
-                new_lines.append(line)
-
-        if not found_subnets:
-            new_lines.append(f"SUBNETS_JSON='{subnets_json_str}'")
-        if not found_cycle:
-            new_lines.append(f"CYCLE={cycle_seconds}")
 
-        new_env = "\n".join(new_lines)
+            new_env = "\n".join(new_lines)
 
-        # Записываем новый .env
-        escaped_env = new_env.replace("'", "'\\''")
-        code, out, err = ssh_exec(client, f"echo '{escaped_env}' > {env_file}")
-        if code != 0:
-            return False, f"Failed to write .env: {err}"
+            # Записываем новый .env
+            try:
+                write_remote_file(client, env_file, new_env)
+            except IOError as e:
+                return False, f"Failed to write .env: {e}"
 
-        logger.info(f"Updated subnets for {server['name']}/{script['name']}")
-        return True, "Подсети обновлены"
+            logger.info("Updated subnets for %s/%s", server["name"], script["name"])
+            return True, "Подсети обновлены"
 
     except Exception as e:
-        logger.error(f"update_script_subnets failed: {e}")
+        logger.error("update_script_subnets failed: %s", e)
         return False, str(e)
-    finally:
-        if client:
-            client.close()
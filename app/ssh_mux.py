@@ -0,0 +1,93 @@
+"""
+Выполнение команд через системный ssh с мультиплексированием (ControlMaster).
+
+Первое подключение к хосту поднимает master-соединение, последующие команды
+в пределах ControlPersist открывают только новый канал поверх него.
+Включается переменной VKPANEL_SSH_MUX=1 и работает только для серверов
+с ключом (key_path): системный ssh не умеет неинтерактивно вводить пароль.
+Нужен клиент OpenSSH (в образе python:3.11-slim его нет — пакет
+openssh-client); без него команды идут через paramiko.
+Ключи хостов проверяются по SSH_KNOWN_HOSTS, как и в paramiko.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+
+from .config import (
+    SSH_TIMEOUT, SSH_COMMAND_TIMEOUT, SSH_MUX, SSH_MUX_DIR, SSH_POOL_IDLE_TTL, SSH_KNOWN_HOSTS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Клиент OpenSSH; None — нет в системе
+_SSH_BIN = shutil.which("ssh") if SSH_MUX else None
+if SSH_MUX and _SSH_BIN is None:
+    logger.warning("VKPANEL_SSH_MUX=1, but ssh client not found - using paramiko")
+
+# Проверка ключей хостов: заданный known_hosts — строго по нему,
+# иначе ключ принимается при первом подключении
+if SSH_KNOWN_HOSTS:
+    _HOST_KEY_OPTIONS = [
+        "-o", f"UserKnownHostsFile={SSH_KNOWN_HOSTS}",
+        "-o", "StrictHostKeyChecking=yes",
+    ]
+else:
+    _HOST_KEY_OPTIONS = ["-o", "StrictHostKeyChecking=accept-new"]
+
+
+def enabled_for(server: dict) -> bool:
+    """Можно ли выполнять команды на сервере через ssh ControlMaster."""
+    return _SSH_BIN is not None and bool(server.get("key_path"))
+
+
+def _control_path(server: dict) -> str:
+    """
+    Путь к сокету master-соединения.
+
+    Короткий хэш вместо user@host:port — путь UNIX сокета ограничен ~104 байтами.
+    """
+    target = f"{server['user']}@{server['host']}:{server.get('port', 22)}"
+    digest = hashlib.sha1(target.encode()).hexdigest()[:12]
+    return os.path.join(SSH_MUX_DIR, digest)
+
+
+def run(
+    server: dict,
+    cmd: str,
+    timeout: int = SSH_COMMAND_TIMEOUT,
+    decode: bool = True,
+) -> tuple[int, str | bytes, str | bytes]:
+    """
+    Выполнить команду через ssh ControlMaster.
+
+    Возвращает (exit_code, stdout, stderr), как ssh_exec (включая decode).
+    """
+    os.makedirs(SSH_MUX_DIR, mode=0o700, exist_ok=True)
+    args = [
+        _SSH_BIN,
+        "-o", "ControlMaster=auto",
+        "-o", f"ControlPath={_control_path(server)}",
+        "-o", f"ControlPersist={SSH_POOL_IDLE_TTL}",
+        "-o", "BatchMode=yes",
+        *_HOST_KEY_OPTIONS,
+        "-o", f"ConnectTimeout={SSH_TIMEOUT}",
+        "-o", "ServerAliveInterval=30",
+        "-i", server["key_path"],
+        "-p", str(server.get("port", 22)),
+        f"{server['user']}@{server['host']}",
+        cmd,
+    ]
+    try:
+        proc = subprocess.run(args, capture_output=True, timeout=timeout)
+    except Exception as e:
+        logger.error("SSH mux exec failed on %s: %.50s... - %s", server["host"], cmd, e)
+        raise
+    if not decode:
+        return proc.returncode, proc.stdout, proc.stderr
+    return (
+        proc.returncode,
+        proc.stdout.decode(errors="replace"),
+        proc.stderr.decode(errors="replace"),
+    )
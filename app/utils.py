@@ -0,0 +1,26 @@
+"""
+Вспомогательные функции.
+"""
+import ipaddress
+from functools import lru_cache
+from typing import Optional
+
+
+@lru_cache(maxsize=4096)
+def parse_ip(ip: str) -> Optional[ipaddress.IPv4Address | ipaddress.IPv6Address]:
+    """
+    Разобрать текстовый IP (с кэшем — одни и те же адреса приходят при
+    каждом обновлении). None, если строка не IP.
+    """
+    try:
+        return ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+
+
+def ip_sort_key(ip: Optional[str]) -> tuple[int, int]:
+    """Ключ сортировки IP в числовом порядке; невалидные — в начало."""
+    addr = parse_ip(ip or "")
+    if addr is None:
+        return 0, 0
+    return addr.version, int(addr)
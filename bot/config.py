@@ -11,5 +11,8 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "")
 PANEL_URL = os.getenv("PANEL_URL", "http://127.0.0.1:8080")
 BOT_API_KEY = os.getenv("BOT_API_KEY", "vkpanel-bot-secret-2026")
 
+# Сколько секунд каталог из панели считается свежим
+API_CACHE_TTL = float(os.getenv("API_CACHE_TTL", "20"))
+
 # Продавец — кнопка "Купить" ведёт сюда
 SELLER_USERNAME = os.getenv("SELLER_USERNAME", "xlmmama")
@@ -4,16 +4,21 @@ aiogram 3 + aiohttp для запросов к панели.
 """
 import asyncio
 import logging
+import time
 
 import aiohttp
+import orjson
 from aiogram import Bot, Dispatcher, Router, F
+from aiogram.client.default import DefaultBotProperties
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import (
     Message, CallbackQuery,
     InlineKeyboardButton, InlineKeyboardMarkup,
 )
 from aiogram.filters import CommandStart
 
-from .config import BOT_TOKEN, PANEL_URL, BOT_API_KEY, SELLER_USERNAME
+from .config import BOT_TOKEN, PANEL_URL, BOT_API_KEY, SELLER_USERNAME, API_CACHE_TTL
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
@@ -22,29 +27,135 @@ router = Router()
 
 SELLERS = "@xlmmama @haxonate"
 
+# Общая HTTP сессия к панели: keep-alive соединения вместо нового TCP
+# на каждый запрос. Создаётся в main() и закрывается при остановке бота.
+_SESSION: aiohttp.ClientSession | None = None
+# Заголовки и тайм-ауты запросов к панели — одни и те же для всех вызовов
+_HEADERS = {"X-API-Key": BOT_API_KEY}
+_TIMEOUT = aiohttp.ClientTimeout(total=10, connect=3, sock_read=7)
+
+# Кэш ответов панели: path -> (время получения, данные, отрисованный текст, ETag).
+# Всплеск нажатий на каталог — один запрос к панели за API_CACHE_TTL,
+# текст каталога собирается один раз на полученные данные. После TTL
+# запрос идёт с If-None-Match: на 304 панель не шлёт тело, запись продлевается
+_cache: dict[str, tuple[float, dict, str | None, str | None]] = {}
+# Блокировка на path: параллельные промахи ждут один запрос (single-flight)
+_cache_locks: dict[str, asyncio.Lock] = {}
+
+START_TEXT = (
+    "👋 <b>Здравствуйте!</b>\n\n"
+    "У нас вы можете полностью выкупить аккаунт VK Cloud "
+    "или арендовать проект с Floating IP.\n\n"
+    f"Для покупки/аренды писать:\n{SELLERS}\n\n"
+    "📋 <b>Тарифы:</b>\n"
+    "• Любой IP на покупку — <b>30 000₽</b>\n"
+    "• Любой IP в аренду — <b>500₽/сутки</b>\n\n"
+    "Выберите, что вас интересует 👇"
+)
+
+# Клавиатуры статичны — собираем один раз при импорте
+MAIN_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="🛒 Купить аккаунт", callback_data="menu:buy")],
+    [InlineKeyboardButton(text="📦 Аренда проекта", callback_data="menu:rent")],
+])
+BACK_KB = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="◀️ Назад", callback_data="menu:back")]
+])
+
 
 def mask_ip(ip: str) -> str:
     """Маскировка IP: 5.188.203.45 → 5.188.***.***"""
-    parts = ip.split(".")
-    if len(parts) == 4:
-        return f"{parts[0]}.{parts[1]}.***.***"
-    return ip
+    if ip.count(".") != 3:
+        return ip
+    return ip[:ip.rfind(".", 0, ip.rfind("."))] + ".***.***"
 
 
-async def api_get(path: str) -> dict:
-    """GET запрос к панели с API ключом."""
+def new_session() -> aiohttp.ClientSession:
+    """HTTP сессия к панели: пул keep-alive соединений, кэш DNS, тайм-ауты."""
+    return aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=50, keepalive_timeout=75, ttl_dns_cache=300),
+        timeout=_TIMEOUT,
+        headers=_HEADERS,
+    )
+
+
+async def get_session() -> aiohttp.ClientSession:
+    """Общая HTTP сессия к панели (если её нет — создаётся)."""
+    global _SESSION
+    if _SESSION is None or _SESSION.closed:
+        _SESSION = new_session()
+    return _SESSION
+
+
+async def close_session() -> None:
+    """Закрыть общую HTTP сессию (при остановке бота)."""
+    global _SESSION
+    if _SESSION is not None:
+        await _SESSION.close()
+        _SESSION = None
+
+
+async def cached_api_get(path: str, ttl: float = API_CACHE_TTL) -> dict:
+    """api_get с кэшем на ttl секунд; ошибки (пустой ответ) не кэшируются."""
+    cached = _cache.get(path)
+    if cached and time.monotonic() - cached[0] < ttl:
+        return cached[1]
+
+    async with _cache_locks.setdefault(path, asyncio.Lock()):
+        # Пока ждали блокировку, данные мог получить другой запрос
+        cached = _cache.get(path)
+        if cached and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+
+        data, etag = await api_get(path, cached[3] if cached else None)
+        if data is None:
+            # 304: каталог не менялся — продлеваем запись вместе с отрисовкой
+            _cache[path] = (time.monotonic(), *cached[1:])
+            return cached[1]
+        if data:
+            _cache[path] = (time.monotonic(), data, None, etag)
+        return data
+
+
+def invalidate(path: str) -> None:
+    """Сбросить закэшированный ответ панели (следующий запрос пойдёт в сеть)."""
+    _cache.pop(path, None)
+
+
+async def get_catalog(path: str, render) -> str:
+    """Текст каталога render(data); отрисовывается один раз на запись кэша."""
+    data = await cached_api_get(path)
+    entry = _cache.get(path)
+    if entry is None or entry[1] is not data:
+        # Ответ не закэширован (ошибка панели) — просто рисуем
+        return render(data)
+    if entry[2] is None:
+        entry = (entry[0], data, render(data), entry[3])
+        _cache[path] = entry
+    return entry[2]
+
+
+async def api_get(path: str, etag: str | None = None) -> tuple[dict | None, str | None]:
+    """
+    GET запрос к панели с API ключом.
+
+    Возвращает (данные, ETag). С etag запрос условный: если панель ответила
+    304, данные — None (у вызывающего актуальная копия). При ошибке — ({}, None).
+    """
     url = f"{PANEL_URL}{path}"
-    headers = {"X-API-Key": BOT_API_KEY}
+    headers = {"If-None-Match": etag} if etag else None
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=10)) as resp:
-                if resp.status != 200:
-                    logger.error(f"Panel API error {resp.status}: {path}")
-                    return {}
-                return await resp.json()
+        session = await get_session()
+        async with session.get(url, headers=headers) as resp:
+            if resp.status == 304 and etag:
+                return None, etag
+            if resp.status != 200:
+                logger.error(f"Panel API error {resp.status}: {path}")
+                return {}, None
+            return orjson.loads(await resp.read()), resp.headers.get("ETag")
     except Exception as e:
         logger.error(f"API request failed: {e}")
-        return {}
+        return {}, None
 
 
 # ─── /start ───────────────────────────────────────────────────
@@ -52,41 +163,17 @@ async def api_get(path: str) -> dict:
 @router.message(CommandStart())
 async def cmd_start(message: Message):
     """Приветствие с тарифами и кнопками."""
-    text = (
-        "👋 <b>Здравствуйте!</b>\n\n"
-        "У нас вы можете полностью выкупить аккаунт VK Cloud "
-        "или арендовать проект с Floating IP.\n\n"
-        f"Для покупки/аренды писать:\n{SELLERS}\n\n"
-        "📋 <b>Тарифы:</b>\n"
-        "• Любой IP на покупку — <b>30 000₽</b>\n"
-        "• Любой IP в аренду — <b>500₽/сутки</b>\n\n"
-        "Выберите, что вас интересует 👇"
-    )
-
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🛒 Купить аккаунт", callback_data="menu:buy")],
-        [InlineKeyboardButton(text="📦 Аренда проекта", callback_data="menu:rent")],
-    ])
-
-    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+    await message.answer(START_TEXT, reply_markup=MAIN_KB)
 
 
 # ─── Каталог покупки ──────────────────────────────────────────
 
-@router.callback_query(F.data == "menu:buy")
-async def cb_buy(callback: CallbackQuery):
-    """Каталог аккаунтов на продажу — простой список."""
-    await callback.answer()
-
-    data = await api_get("/api/bot/accounts")
+def render_accounts(data: dict) -> str:
+    """HTML текст каталога аккаунтов на продажу."""
     accounts = data.get("accounts", [])
 
     if not accounts:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="◀️ Назад", callback_data="menu:back")]
-        ])
-        await callback.message.answer("😔 Сейчас нет аккаунтов в продаже.\n\nЗагляните позже!", reply_markup=keyboard)
-        return
+        return "😔 Сейчас нет аккаунтов в продаже.\n\nЗагляните позже!"
 
     lines = ["🛒 <b>Аккаунты на продажу</b>\n"]
 
@@ -104,29 +191,26 @@ async def cb_buy(callback: CallbackQuery):
 
     lines.append(f"\nДля покупки: {SELLERS}")
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="menu:back")]
-    ])
+    return "\n".join(lines)
 
-    await callback.message.answer("\n".join(lines), parse_mode="HTML", reply_markup=keyboard)
 
+@router.callback_query(F.data == "menu:buy")
+async def cb_buy(callback: CallbackQuery):
+    """Каталог аккаунтов на продажу — простой список."""
+    await callback.answer()
 
-# ─── Каталог аренды ───────────────────────────────────────────
+    text = await get_catalog("/api/bot/accounts", render_accounts)
+    await callback.message.answer(text, reply_markup=BACK_KB)
 
-@router.callback_query(F.data == "menu:rent")
-async def cb_rent(callback: CallbackQuery):
-    """Каталог проектов на аренду — простой список."""
-    await callback.answer()
 
-    data = await api_get("/api/bot/rentals")
+# ─── Каталог аренды ───────────────────────────────────────────
+
+def render_rentals(data: dict) -> str:
+    """HTML текст каталога проектов на аренду."""
     projects = data.get("projects", [])
 
     if not projects:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="◀️ Назад", callback_data="menu:back")]
-        ])
-        await callback.message.answer("😔 Сейчас нет проектов для аренды.\n\nЗагляните позже!", reply_markup=keyboard)
-        return
+        return "😔 Сейчас нет проектов для аренды.\n\nЗагляните позже!"
 
     lines = ["📦 <b>Проекты на аренду</b>\n"]
 
@@ -140,35 +224,87 @@ async def cb_rent(callback: CallbackQuery):
 
     lines.append(f"\nДля аренды: {SELLERS}")
 
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="menu:back")]
-    ])
+    return "\n".join(lines)
 
-    await callback.message.answer("\n".join(lines), parse_mode="HTML", reply_markup=keyboard)
+
+@router.callback_query(F.data == "menu:rent")
+async def cb_rent(callback: CallbackQuery):
+    """Каталог проектов на аренду — простой список."""
+    await callback.answer()
+
+    text = await get_catalog("/api/bot/rentals", render_rentals)
+    await callback.message.answer(text, reply_markup=BACK_KB)
 
 
 # ─── Назад в меню ─────────────────────────────────────────────
 
 @router.callback_query(F.data == "menu:back")
 async def cb_back(callback: CallbackQuery):
-    """Вернуться в главное меню."""
+    """Вернуться в главное меню — правкой того же сообщения, без нового."""
     await callback.answer()
-    await cmd_start(callback.message)
+    try:
+        await callback.message.edit_text(START_TEXT, reply_markup=MAIN_KB)
+    except TelegramBadRequest as e:
+        # Уже показано меню — править нечего
+        if "message is not modified" in str(e):
+            return
+        logger.warning(f"Edit to main menu failed, sending new message: {e}")
+        await cmd_start(callback.message)
+
+
+# ─── Прогрев кэша ─────────────────────────────────────────────
+
+CATALOGS = {
+    "/api/bot/accounts": render_accounts,
+    "/api/bot/rentals": render_rentals,
+}
+
+
+async def warm_catalog(path: str, render, ttl: float) -> None:
+    """Обновить каталог в кэше, если он старше ttl, и сразу отрисовать."""
+    await cached_api_get(path, ttl=ttl)
+    await get_catalog(path, render)
+
+
+async def warmup() -> None:
+    """
+    Фоновый прогрев каталогов: оба запроса к панели параллельно,
+    раньше чем истечёт API_CACHE_TTL — первый клик не ждёт панель.
+    """
+    # Не чаще раза в секунду, даже при очень маленьком TTL
+    interval = max(API_CACHE_TTL * 0.75, 1.0)
+    while True:
+        try:
+            await asyncio.gather(
+                *(warm_catalog(path, render, interval) for path, render in CATALOGS.items())
+            )
+        except Exception as e:
+            logger.error(f"Catalog warmup failed: {e}")
+        await asyncio.sleep(interval)
 
 
 # ─── Запуск ───────────────────────────────────────────────────
 
 async def main():
+    global _SESSION
     if not BOT_TOKEN:
         logger.error("BOT_TOKEN not set! Export BOT_TOKEN env variable.")
         return
 
-    bot = Bot(token=BOT_TOKEN)
+    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     dp = Dispatcher()
     dp.include_router(router)
 
+    _SESSION = new_session()
+    # Кэш выключен (API_CACHE_TTL <= 0) — прогревать нечего
+    warmup_task = asyncio.create_task(warmup()) if API_CACHE_TTL > 0 else None
     logger.info("Bot starting...")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if warmup_task:
+            warmup_task.cancel()
+        await close_session()
 
 
 if __name__ == "__main__":